@@ -0,0 +1,62 @@
+from .storage import TABLES, KEY_COLUMNS
+
+
+def csv_value(value):
+    # In Postgres CSV an unquoted empty field is NULL and a quoted one is
+    # an empty string, so every other value is quoted.
+    if value is None:
+        return ''
+    return '"{0}"'.format(str(value).replace('"', '""'))
+
+
+def encode_rows(rows):
+    # Turns per-table record lists into what a batch keeps of them: COPY
+    # CSV bytes, row counts and the public keys to notify. Runs wherever
+    # the rows were built, so only bytes reach the buffer.
+    data, counts, keys = {}, {}, set()
+    for table, columns, _, _ in TABLES:
+        records = rows.get(table)
+        if not records:
+            continue
+
+        data[table] = ''.join(','.join(map(csv_value, record)) + '\n' for record in records).encode('utf-8')
+        counts[table] = len(records)
+        if table in KEY_COLUMNS:
+            index = columns.index(KEY_COLUMNS[table])
+            keys.update(record[index] for record in records)
+    keys.discard(None)
+    return data, counts, keys
+
+
+class RowBuffer:
+    # One bytearray of COPY-ready CSV per table instead of a tuple and an
+    # object per field, so size is what the batch really holds. The
+    # parser checks rows and size after every block, so a batch goes past
+    # flush_rows/flush_bytes by at most one block's rows.
+    __slots__ = ('tables', 'counts', 'keys', 'rows', 'size', 'heights')
+
+    def __init__(self):
+        self.tables = {table: bytearray() for table, _, _, _ in TABLES}
+        self.counts = {table: 0 for table, _, _, _ in TABLES}
+        self.keys = set()
+        self.rows = 0
+        self.size = 0
+        self.heights = None
+
+    def extend(self, chunk):
+        data, counts, keys = chunk
+        for table, encoded in data.items():
+            self.tables[table] += encoded
+            self.counts[table] += counts[table]
+            self.rows += counts[table]
+            self.size += len(encoded)
+        self.keys |= keys
+
+    def count(self, table):
+        return self.counts[table]
+
+    def data(self, table):
+        return self.tables[table]
+
+    def full(self, max_rows, max_size):
+        return self.rows >= max_rows or self.size >= max_size
@@ -0,0 +1,78 @@
+import os
+from collections import OrderedDict
+
+
+class AttachmentCache:
+    # IPFS content is immutable, so entries never need invalidation, only
+    # eviction. One file per object under <path>/<last two chars>/<hash>;
+    # file mtime carries the LRU order across restarts.
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self.size = 0
+        self.entries = OrderedDict()
+
+        os.makedirs(self.path, exist_ok=True)
+        self.load()
+
+    def file_path(self, ipfs_hash):
+        return os.path.join(self.path, ipfs_hash[-2:], ipfs_hash)
+
+    def load(self):
+        files = []
+        for root, _, names in os.walk(self.path):
+            for name in names:
+                path = os.path.join(root, name)
+                if name.endswith('.tmp'):
+                    os.remove(path)
+                    continue
+                stat = os.stat(path)
+                files.append((stat.st_mtime, name, stat.st_size))
+
+        for _, ipfs_hash, size in sorted(files):
+            self.entries[ipfs_hash] = size
+            self.size += size
+        self.evict()
+
+    def get(self, ipfs_hash):
+        if ipfs_hash not in self.entries:
+            return None
+
+        path = self.file_path(ipfs_hash)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            self.size -= self.entries.pop(ipfs_hash)
+            return None
+
+        self.entries.move_to_end(ipfs_hash)
+        return data.decode('utf-8')
+
+    def put(self, ipfs_hash, data):
+        if ipfs_hash in self.entries or not ipfs_hash.isalnum():
+            return
+
+        raw = data.encode('utf-8')
+        if len(raw) > self.max_size:
+            return
+
+        path = self.file_path(ipfs_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(raw)
+        os.replace(path + '.tmp', path)
+
+        self.entries[ipfs_hash] = len(raw)
+        self.size += len(raw)
+        self.evict()
+
+    def evict(self):
+        while self.size > self.max_size and self.entries:
+            ipfs_hash, size = self.entries.popitem(last=False)
+            self.size -= size
+            try:
+                os.remove(self.file_path(ipfs_hash))
+            except FileNotFoundError:
+                pass
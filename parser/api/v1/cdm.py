@@ -0,0 +1,108 @@
+import xml.etree.ElementTree as ET
+
+
+class Cdm:
+    __slots__ = ('version', 'blockchain', 'network', 'tables', 'columns', 'values')
+
+    def __init__(self):
+        self.version = None
+        self.blockchain = None
+        self.network = None
+        self.tables = []
+        self.columns = []
+        self.values = []
+
+
+class TableOp:
+    __slots__ = ('hash', 'ciphertext', 'recipient')
+
+    def __init__(self, hash, ciphertext, recipient):
+        self.hash = hash
+        self.ciphertext = ciphertext
+        self.recipient = recipient
+
+
+class ColumnOp:
+    __slots__ = ('hash', 'table_hash', 'ciphertext', 'recipient')
+
+    def __init__(self, hash, table_hash, ciphertext, recipient):
+        self.hash = hash
+        self.table_hash = table_hash
+        self.ciphertext = ciphertext
+        self.recipient = recipient
+
+
+class ValueOp:
+    __slots__ = ('hash', 'col_hash', 'ciphertext', 'col_ciphertext', 'recipient')
+
+    def __init__(self, hash, col_hash, ciphertext, col_ciphertext, recipient):
+        self.hash = hash
+        self.col_hash = col_hash
+        self.ciphertext = ciphertext
+        self.col_ciphertext = col_ciphertext
+        self.recipient = recipient
+
+
+def text(elem, tag):
+    found = elem.find(tag)
+    return found.text if found is not None else None
+
+
+def child(elem, tag):
+    # Elements without children are treated as absent, as before.
+    found = elem.find(tag)
+    return found if found is not None and len(found) else None
+
+
+def recipient_key(operation):
+    recipient = child(operation, 'recipient')
+    return text(recipient, 'publickey') if recipient is not None else None
+
+
+def decode(attachment):
+    # The tree is built by the C parser and every element is looked up once.
+    # Python-level pull parsing (iterparse or expat callbacks) measured
+    # slower than this on large CDMs, since building the tree is most of the
+    # cost and per-event callbacks run in the interpreter.
+    cdm = Cdm()
+    root = ET.fromstring(attachment)
+    cdm.version = text(root, 'version')
+    cdm.blockchain = text(root, 'blockchain')
+    cdm.network = text(root, 'network')
+
+    operations = root.find('operations')
+    if operations is None:
+        return cdm
+
+    create = child(operations, 'create')
+    if create is not None:
+        recipient = recipient_key(create)
+        table_hash = None
+        table = child(create, 'table')
+        if table is not None:
+            table_hash = text(table, 'sha256')
+            cdm.tables.append(TableOp(table_hash, text(table, 'ciphertext'), recipient))
+
+        columns = child(create, 'columns')
+        if columns is not None:
+            for col in columns.iterfind('column'):
+                if len(col):
+                    cdm.columns.append(ColumnOp(text(col, 'sha256'), table_hash, text(col, 'ciphertext'), recipient))
+
+    insert = child(operations, 'insert')
+    if insert is not None:
+        recipient = recipient_key(insert)
+        columns = child(insert, 'columns')
+        if columns is not None:
+            for col in columns.iterfind('column'):
+                if len(col):
+                    value = child(col, 'value')
+                    cdm.values.append(ValueOp(
+                        text(value, 'sha256') if value is not None else None,
+                        text(col, 'sha256'),
+                        text(value, 'ciphertext') if value is not None else None,
+                        text(col, 'ciphertext'),
+                        recipient
+                    ))
+
+    return cdm
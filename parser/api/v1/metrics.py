@@ -0,0 +1,97 @@
+import bisect
+from time import time
+from collections import deque
+from contextlib import contextmanager
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STAGES = ('node', 'ipfs', 'parse', 'save')
+COUNTERS = (
+    'ipfsHits',
+    'ipfsMisses',
+    'ipfsTimeouts',
+    'ipfsErrors',
+    'ipfsRetriesResolved',
+    'ipfsRetriesFailed',
+    'ipfsRetriesExpired',
+    'nodeErrors',
+    'badAttachments'
+)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+
+    def to_dict(self):
+        buckets = {}
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'avg': round(self.sum / self.count, 6) if self.count else None,
+            'buckets': buckets
+        }
+
+
+class Rate:
+    def __init__(self, window=60):
+        self.window = window
+        self.events = deque()
+        self.total = 0
+
+    def add(self, count):
+        now = time()
+        self.total += count
+        self.events.append((now, count))
+        self.trim(now)
+
+    def trim(self, now):
+        while self.events and self.events[0][0] < now - self.window:
+            self.events.popleft()
+
+    def per_second(self):
+        self.trim(time())
+        return round(sum(count for _, count in self.events) / self.window, 3)
+
+
+class Metrics:
+    def __init__(self):
+        self.started = time()
+        self.stages = {stage: Histogram() for stage in STAGES}
+        self.counters = {counter: 0 for counter in COUNTERS}
+        self.blocks = Rate()
+        self.transactions = Rate()
+        self.rows = Rate()
+
+    @contextmanager
+    def timer(self, stage):
+        t0 = time()
+        try:
+            yield
+        finally:
+            self.stages[stage].observe(time() - t0)
+
+    def inc(self, counter, count=1):
+        self.counters[counter] += count
+
+    def to_dict(self):
+        return {
+            'uptime': round(time() - self.started, 3),
+            'stages': {stage: histogram.to_dict() for stage, histogram in self.stages.items()},
+            'counters': dict(self.counters),
+            'blocks': {'total': self.blocks.total, 'perSecond': self.blocks.per_second()},
+            'transactions': {'total': self.transactions.total, 'perSecond': self.transactions.per_second()},
+            'rows': {'total': self.rows.total, 'perSecond': self.rows.per_second()}
+        }
@@ -4,51 +4,82 @@ from sanic.response import json
 from sanic.log import logger
 import asyncio
 import aiohttp
-import requests
-import psycopg2
+import collections
+from concurrent.futures import ProcessPoolExecutor
+import asyncpg
 import json as pjson
-from psycopg2.extras import execute_values
-import hashlib
-from datetime import datetime
+import orjson
 from time import time
 from .errors import bad_request
+from .cache import AttachmentCache
+from .storage import create_pool, save_batch
+from .rows import blocks_rows, retry_rows
+from .buffer import RowBuffer
+from .metrics import Metrics
+from .tip import TipFollower
 import configparser
-import uuid
 import signal
 import base58
-import xml.etree.ElementTree as ET
 
 config = configparser.ConfigParser()
 config.read('config.ini')
 
 parser = Blueprint('parser_v1', url_prefix='/parser')
-dsn = {
-    "user": os.environ['POSTGRES_USER'],
-    "password": os.environ['POSTGRES_PASSWORD'],
-    "database": os.environ['POSTGRES_DB'],
-    "host": config['DB']['host'],
-    "port": config['DB']['port'],
-    "sslmode": config['DB']['sslmode'],
-    "target_session_attrs": config['DB']['target_session_attrs']
-}
+
+
+def block_id(data):
+    return data.get('id') or data['signature']
+
+
+def block_header(data):
+    return data['height'], block_id(data), data['reference']
 
 
 class Parser:
     def __init__(self):
         self.height = 1
+        self.start_height = 1
+        self.resume_height = 1
         self.last_block = None
-        self.step = 5
-        self.blocks_to_check = 5
+        self.liquid_height = None
+        self.step = int(config['parser']['step'])
+        self.blocks_to_check = int(config['parser']['blocks_to_check'])
+        self.window = int(config['parser']['window'])
+        self.batches_window = int(config['parser']['batches_window'])
+        self.fetch_mode = config['parser']['fetch_mode']
+        self.seq_chunk = int(config['parser']['seq_chunk'])
+        self.headers_first = config['parser'].getboolean('headers_first')
+        self.tip = TipFollower(
+            os.environ['NODE_URL'],
+            float(config['parser']['tip_min_interval']),
+            float(config['parser']['tip_max_interval'])
+        )
+        self.fetch_failed = False
+        self.save_failed = False
 
         self.db_reconnects = 0
         self.db_max_reconnects = 10
-        self.transactions_inserted = 0
 
-        self.sql_data_transactions = []
-        self.sql_data_proofs = []
-        self.sql_data_tables = []
-        self.sql_data_columns = []
-        self.sql_data_values = []
+        self.ipfs_concurrency = int(config['ipfs']['concurrency'])
+        self.ipfs_timeout = aiohttp.ClientTimeout(total=float(config['ipfs']['timeout']))
+        self.ipfs_semaphore = None
+        self.pool = None
+        self.retry_interval = float(config['retry']['interval'])
+        self.retry_batch = int(config['retry']['batch'])
+        self.retry_base_delay = float(config['retry']['base_delay'])
+        self.retry_max_delay = float(config['retry']['max_delay'])
+        self.retry_max_attempts = int(config['retry']['max_attempts'])
+        self.attachment_cache = AttachmentCache(config['cache']['path'], int(config['cache']['max_size']))
+
+        self.processes = int(config['parser']['processes'])
+        self.process_pool = None
+        self.flush_rows = int(config['parser']['flush_rows'])
+        self.flush_bytes = int(config['parser']['flush_bytes'])
+        self.rows = RowBuffer()
+        self.batch_start = None
+        self.batch_end = None
+        self.saved_height = None
+        self.metrics = Metrics()
 
     async def emergency_stop_loop(self, title, error):
         logger.info('Emergency loop stop request')
@@ -62,216 +93,147 @@ class Parser:
         loop.stop()
         return bad_request(error)
 
-    async def fetch_data(self, url, session):
+    async def fetch_attachment(self, ipfs_hash, session):
+        attachment = self.attachment_cache.get(ipfs_hash)
+        if attachment is not None:
+            self.metrics.inc('ipfsHits')
+            return attachment
+
+        self.metrics.inc('ipfsMisses')
+        url = '{0}:{1}/ipfs/{2}'.format(config['ipfs']['host'], config['ipfs']['port'], ipfs_hash)
         try:
+            async with self.ipfs_semaphore:
+                with self.metrics.timer('ipfs'):
+                    async with session.get(url, timeout=self.ipfs_timeout) as response:
+                        if response.status != 200:
+                            raise Exception('IPFS responded with status {0}'.format(response.status))
+                        attachment = await response.text()
+            self.attachment_cache.put(ipfs_hash, attachment)
+            return attachment
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            self.metrics.inc('ipfsTimeouts')
+            logger.error('IPFS Timeout on {0}'.format(ipfs_hash))
+            return None
+        except Exception as error:
+            self.metrics.inc('ipfsErrors')
+            logger.error('IPFS Error on {0}: {1!r}'.format(ipfs_hash, error))
+            return None
+
+    async def fetch_raw(self, url, session):
+        with self.metrics.timer('node'):
             async with session.get(url) as response:
-                data = await response.text()
-                data = pjson.loads(data)
-                cnfy_id = 'cnfy-{}'.format(str(uuid.uuid4()))
-
-                for tx in data['transactions']:
-                    if tx['type'] in [4] and tx['feeAssetId'] == os.environ['ASSET_ID']:
-                        
-                        attachment_base58 = base58.b58decode(tx['attachment']).decode('utf-8')
-                        attachment = None
-                        try:
-                            attachment = requests.get('{0}:{1}/ipfs/{2}'.format(config['ipfs']['host'], config['ipfs']['port'], attachment_base58), timeout=2).text
-                        except Exception as error:
-                            logger.error('IPFS Error: {0}'.format(error))
-
-                        if attachment == None:
-                            logger.warning('CONTINUE ON IPFS HASH {0}'.format(attachment_base58) )
-                            continue
-
-                        attachment_hash = hashlib.sha256(attachment.encode('utf-8')).hexdigest()
-
-                        root = ET.fromstring(attachment)
-                        version = root.findall('version')[0].text if len(root.findall('version')) > 0 else None
-                        blockchain = root.findall('blockchain')[0].text if len(root.findall('blockchain')) > 0 else None
-                        network = root.findall('network')[0].text if len(root.findall('network')) > 0 else None
-                        operations = root.findall('operations')[0] if len(root.findall('operations')) > 0 else []
-
-                        if str(version) != str(os.environ['CDM_VERSION']):
-                            continue
-                        
-                        operation_create = operations.findall('create')[0] if len(operations.findall('create')) > 0 else None
-                        operation_insert = operations.findall('insert')[0] if len(operations.findall('insert')) > 0 else None
-                        if (operation_create):
-                            table_ciphertext = None
-                            table_sha256hash = None
-                            table = operation_create.findall('table')[0] if len(operation_create.findall('table')) > 0 else None
-                            
-                            recipient_public_key = None
-                            recipient = operation_create.findall('recipient')[0] if len(operation_create.findall('recipient')) > 0 else None
-                            if recipient:
-                                recipient_public_key = recipient.findall('publickey')[0].text if len(recipient.findall('publickey')) > 0 else None
-                                
-                            if table:
-                                table_ciphertext = table.findall('ciphertext')[0].text if len(table.findall('ciphertext')) > 0 else None
-                                table_sha256hash = table.findall('sha256')[0].text if len(table.findall('sha256')) > 0 else None
-
-                                self.sql_data_tables.append((
-                                    table_sha256hash,
-                                    tx['id'],
-                                    table_ciphertext,
-                                    recipient_public_key
-                                ))
-
-                            columns = operation_create.findall('columns')[0] if len(operation_create.findall('columns')) > 0 else None
-                            if columns:
-                                cols = columns.findall('column') if len(columns.findall('column')) > 0 else None
-                                for col in cols:
-                                    col_ciphertext = None
-                                    col_sha256hash = None
-
-                                    if col:
-                                        col_ciphertext = col.findall('ciphertext')[0].text if len(col.findall('ciphertext')) > 0 else None
-                                        col_sha256hash = col.findall('sha256')[0].text if len(col.findall('sha256')) > 0 else None
-
-                                        self.sql_data_columns.append((
-                                            col_sha256hash,
-                                            table_sha256hash,
-                                            col_ciphertext,
-                                            recipient_public_key
-                                        ))
-
-                        if (operation_insert):
-                            table_ciphertext = None
-                            table_sha256hash = None
-                            table = operation_insert.findall('table')[0] if len(operation_insert.findall('table')) > 0 else None
-
-                            recipient_public_key = None
-                            recipient = operation_insert.findall('recipient')[0] if len(operation_insert.findall('recipient')) > 0 else None
-                            if recipient:
-                                recipient_public_key = recipient.findall('publickey')[0].text if len(recipient.findall('publickey')) > 0 else None
-                                
-                            columns = operation_insert.findall('columns')[0] if len(operation_insert.findall('columns')) > 0 else None
-                            if columns:
-                                cols = columns.findall('column') if len(columns.findall('column')) > 0 else None
-                                for col in cols:
-                                    col_ciphertext = None
-                                    col_sha256hash = None
-                                    val_ciphertext = None
-                                    val_sha256hash = None
-
-                                    if col:
-                                        col_ciphertext = col.findall('ciphertext')[0].text if len(col.findall('ciphertext')) > 0 else None
-                                        col_sha256hash = col.findall('sha256')[0].text if len(col.findall('sha256')) > 0 else None
-                                        
-                                        value = col.findall('value')[0] if len(col.findall('value')) > 0 else None
-                                        if value:
-                                            val_ciphertext = value.findall('ciphertext')[0].text if len(value.findall('ciphertext')) > 0 else None
-                                            val_sha256hash = value.findall('sha256')[0].text if len(value.findall('sha256')) > 0 else None
-                                        
-                                        self.sql_data_values.append((
-                                            val_sha256hash,
-                                            col_sha256hash,
-                                            val_ciphertext,
-                                            col_ciphertext,
-                                            recipient_public_key
-                                        ))
-                                        print(self.sql_data_values)
-
-                        tx_data = (
-                            tx['id'],
-                            data['height'],
-                            tx['type'],
-                            tx['sender'],
-                            tx['senderPublicKey'],
-                            tx['recipient'],
-                            tx['amount'],
-                            tx['assetId'],
-                            tx['feeAssetId'],
-                            tx['feeAsset'],
-                            tx['fee'],
-                            tx['attachment'],
-                            tx['version'],
-                            datetime.fromtimestamp(tx['timestamp'] / 1e3),
-                            cnfy_id,
-                            attachment_hash
-                        )
-                        
-                        self.sql_data_transactions.append(tx_data)
-
-                        for proof in tx['proofs']:
-                            proof_id = 'proof-' + str(uuid.uuid4())
-                            self.sql_data_proofs.append((tx['id'], proof, proof_id))
-
-                       
+                return await response.read()
+
+    async def fetch_json(self, url, session):
+        return orjson.loads(await self.fetch_raw(url, session))
+
+    async def fetch_attachments(self, data, session):
+        asset_id = os.environ['ASSET_ID']
+        txs, ipfs_hashes = [], []
+        for tx in data['transactions']:
+            if tx['type'] != 4 or tx.get('feeAssetId') != asset_id:
+                continue
+
+            # Attachments are arbitrary bytes chosen by the sender, so one
+            # that is not an IPFS hash only skips its own transaction.
+            try:
+                ipfs_hash = base58.b58decode(tx['attachment']).decode('utf-8')
+            except Exception as error:
+                self.metrics.inc('badAttachments')
+                logger.warning('Skipping transaction {0} with undecodable attachment: {1}'.format(tx.get('id'), error))
+                continue
+
+            txs.append(tx)
+            ipfs_hashes.append(ipfs_hash)
+
+        attachments = await asyncio.gather(*[self.fetch_attachment(ipfs_hash, session) for ipfs_hash in ipfs_hashes])
+
+        return block_header(data), txs, ipfs_hashes, attachments
+
+    async def fetch_block(self, height, session):
+        try:
+            data = await self.fetch_json('{0}/blocks/at/{1}'.format(os.environ['NODE_URL'], height), session)
+            return [await self.fetch_attachments(data, session)]
 
         except asyncio.CancelledError:
             logger.info('Parser has been stopped')
             raise
         except Exception as error:
+            self.metrics.inc('nodeErrors')
             logger.error('Fetching data error: {}'.format(error))
-            pass
-            # await self.emergency_stop_loop('Fetch data', error)
+            return None
 
-    async def save_data(self):
-        conn = psycopg2.connect(**dsn)
+    async def fetch_range(self, first_height, last_height, session):
         try:
-            with conn:
-                with conn.cursor() as cur:
-                    if len(self.sql_data_transactions) > 0:
-                        sql = """INSERT INTO transactions (
-                            id,
-                            height,
-                            type,
-                            sender,
-                            sender_public_key,
-                            recipient,
-                            amount,
-                            asset_id,
-                            fee_asset_id,
-                            fee_asset,
-                            fee,
-                            attachment,
-                            version,
-                            timestamp,
-                            cnfy_id,
-                            attachment_hash
-                        ) VALUES %s ON CONFLICT (id) DO UPDATE SET height = EXCLUDED.height"""
-                        execute_values(cur, sql, self.sql_data_transactions)
-                        if cur.rowcount > 0:
-                            self.transactions_inserted += cur.rowcount
-
-                        sql = """INSERT INTO proofs (tx_id, proof, id) VALUES %s ON CONFLICT DO NOTHING"""
-                        execute_values(cur, sql, self.sql_data_proofs)
-
-                        sql = """INSERT INTO tables (
-                            hash,
-                            tx_id,
-                            ciphertext,
-                            recipient
-                        ) VALUES %s ON CONFLICT DO NOTHING"""
-                        execute_values(cur, sql, self.sql_data_tables)
-
-                        if len(self.sql_data_columns) > 0:
-                            sql = """INSERT INTO columns (
-                                hash,
-                                table_hash,
-                                ciphertext,
-                                recipient
-                            ) VALUES %s ON CONFLICT DO NOTHING"""
-                            execute_values(cur, sql, self.sql_data_columns)
-
-                        print('self.sql_data_values', self.sql_data_values)
-                        if len(self.sql_data_values) > 0:
-                            sql = """INSERT INTO values (
-                                val_hash,
-                                col_hash,
-                                val_ciphertext,
-                                col_ciphertext,
-                                recipient
-                            ) VALUES %s ON CONFLICT DO NOTHING"""
-                            execute_values(cur, sql, self.sql_data_values)
-
-                    conn.commit()
-                    logger.info('Saved {0} transactions'.format(self.transactions_inserted))
-
-        except psycopg2.IntegrityError as error:
-            logger.info('Error', error)
-            pass
+            blocks = []
+            runs = [(first_height, last_height)]
+            headers = []
+            if self.headers_first:
+                headers = await self.fetch_json('{0}/blocks/headers/seq/{1}/{2}'.format(
+                    os.environ['NODE_URL'], first_height, last_height), session)
+
+                # Headers only carry the total transaction count, so blocks
+                # without any transactions are skipped and the rest are
+                # requested as contiguous runs.
+                runs = []
+                for header in headers:
+                    if header['transactionCount'] == 0:
+                        blocks.append((block_header(header), [], [], []))
+                        continue
+                    if runs and runs[-1][1] == header['height'] - 1:
+                        runs[-1] = (runs[-1][0], header['height'])
+                    else:
+                        runs.append((header['height'], header['height']))
+
+            asset_id = os.environ['ASSET_ID'].encode('utf-8')
+            headers = {header['height']: header for header in headers}
+            for run in runs:
+                raw = await self.fetch_raw('{0}/blocks/seq/{1}/{2}'.format(os.environ['NODE_URL'], *run), session)
+
+                # A run whose raw bytes never mention the asset cannot hold
+                # any of our transactions, so its known headers are used and
+                # none of its transactions are decoded.
+                if headers and asset_id not in raw:
+                    blocks += [(block_header(headers[height]), [], [], []) for height in range(run[0], run[1] + 1)]
+                    continue
+
+                data = orjson.loads(raw)
+                blocks += await asyncio.gather(*[self.fetch_attachments(block, session) for block in data])
+            return sorted(blocks, key=lambda block: block[0][0])
+
+        except asyncio.CancelledError:
+            logger.info('Parser has been stopped')
+            raise
+        except Exception as error:
+            self.metrics.inc('nodeErrors')
+            logger.error('Fetching range {0} - {1} error: {2}'.format(first_height, last_height, error))
+            return None
+
+    def take_batch(self):
+        batch = self.rows
+        batch.heights = (self.batch_start, self.batch_end)
+        self.rows = RowBuffer()
+        self.batch_start = None
+        return batch
+
+    async def save_data(self, batch):
+        # Returns whether the batch was committed.
+        try:
+            with self.metrics.timer('save'):
+                async with self.pool.acquire() as conn:
+                    transactions_inserted = await save_batch(conn, batch)
+            self.metrics.blocks.add(batch.count('blocks'))
+            self.metrics.transactions.add(batch.count('transactions'))
+            self.metrics.rows.add(batch.rows)
+            logger.info('Height range {0} - {1}'.format(*batch.heights))
+            logger.info('Saved {0} transactions'.format(transactions_inserted))
+            return True
+
+        except asyncpg.IntegrityConstraintViolationError as error:
+            logger.error('Height range {0} - {1} was not saved: {2}'.format(*batch.heights, error))
+            return False
         except asyncio.CancelledError:
             logger.info('Parser has been stopped')
             raise
@@ -279,102 +241,308 @@ class Parser:
             logger.info('Height: {}'.format(self.height))
             logger.error('Batch insert error: {}'.format(error))
             await self.emergency_stop_loop('Batch insert error', error)
+
+    async def find_fork_point(self, session):
+        # Only key blocks below the tip are compared: the id of the liquid
+        # block changes with every microblock, so it is never stored in
+        # blocks and is simply read again on the next pass.
+        stored_height = await self.pool.fetchval("SELECT max(height) FROM blocks")
+
+        if stored_height is None:
+            return None, None
+
+        checked_height = min(stored_height, self.last_block - 1)
+        height = checked_height
+        size = 1
+        while height > 0:
+            first_height = max(height - size + 1, 1)
+            headers = await self.fetch_json('{0}/blocks/headers/seq/{1}/{2}'.format(
+                os.environ['NODE_URL'], first_height, height), session)
+            node_blocks = {header['height']: block_id(header) for header in headers}
+
+            stored_blocks = await self.pool.fetch("""
+                SELECT height, signature FROM blocks
+                WHERE height BETWEEN $1 AND $2
+                ORDER BY height DESC
+            """, first_height, height)
+
+            for block_height, signature in stored_blocks:
+                if node_blocks.get(block_height) == signature:
+                    return checked_height, block_height
+
+            height = first_height - 1
+            size = self.seq_chunk
+
+        return checked_height, 0
+
+    async def rollback(self, fork_point):
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("DELETE FROM transactions WHERE height > $1", fork_point)
+                await conn.execute("DELETE FROM blocks WHERE height > $1", fork_point)
+                await conn.execute("DELETE FROM ipfs_retries WHERE height > $1", fork_point)
+
+    async def fetch_stage(self, session, blocks):
+        while self.height <= self.last_block:
+            if self.fetch_mode == 'seq':
+                last_height = min(self.height + self.seq_chunk - 1, self.last_block)
+                task = asyncio.create_task(self.fetch_range(self.height, last_height, session))
+            else:
+                last_height = self.height
+                task = asyncio.create_task(self.fetch_block(self.height, session))
+
+            try:
+                await blocks.put((self.height, last_height, task))
+            except asyncio.CancelledError:
+                task.cancel()
+                raise
+            self.height = last_height + 1
+        await blocks.put(None)
+
+    def parse_blocks(self, blocks_data):
+        # Without a process pool, rows (and their signature checks) are
+        # built on the default thread pool so the event loop keeps serving
+        # fetches and saves meanwhile.
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(self.process_pool, blocks_rows, blocks_data, self.liquid_height)
+
+    async def collect(self, parsed, batches):
+        # The row and byte thresholds are checked after every block, so a
+        # batch is cut as soon as one is reached; otherwise batches end
+        # with a fetched range once they span `step` heights.
+        height, last_height, future = parsed
+        chunks, elapsed = await future
+        self.metrics.stages['parse'].observe(elapsed)
+
+        for block_height, chunk in chunks:
+            if self.batch_start is None:
+                self.batch_start = block_height
+            self.batch_end = block_height
+            self.rows.extend(chunk)
+            if self.rows.full(self.flush_rows, self.flush_bytes):
+                await batches.put(self.take_batch())
+
+        if self.batch_start is None:
+            return
+        self.batch_end = last_height
+        if self.batch_end - self.batch_start + 1 >= self.step:
+            await batches.put(self.take_batch())
+
+    async def parse_stage(self, blocks, batches):
+        # Up to `processes` fetched ranges are parsed at once; results are
+        # collected strictly in height order.
+        pending = collections.deque()
+        while True:
+            item = await blocks.get()
+            if item is None or self.save_failed:
+                break
+
+            height, last_height, task = item
+            blocks_data = await task
+            if blocks_data is None:
+                self.fetch_failed = True
+                # Nothing past a failed fetch is saved; the next poll resumes
+                # right after the last stored block.
+                break
+
+            pending.append((height, last_height, self.parse_blocks(blocks_data)))
+            if len(pending) > self.processes:
+                await self.collect(pending.popleft(), batches)
+
+        while pending and not self.save_failed:
+            await self.collect(pending.popleft(), batches)
+        if self.batch_start is not None and not self.save_failed:
+            await batches.put(self.take_batch())
+        await batches.put(None)
+
+    async def save_stage(self, batches):
+        while True:
+            t0 = time()
+            batch = await batches.get()
+            if batch is None:
+                break
+            if self.save_failed:
+                # Batches parsed past a rolled back one are dropped, so
+                # saved_height only ever covers committed heights.
+                continue
+
+            if not await self.save_data(batch):
+                self.save_failed = True
+                continue
+            self.saved_height = batch.heights[1]
+            logger.info('Parsing time: {0} sec'.format(time() - t0))
+            logger.info('-' * 40)
+
+    async def run_pipeline(self, session):
+        # About `window` blocks are fetched ahead of the parser (in seq mode
+        # window // seq_chunk ranges, plus the one being parsed and the one
+        # waiting to be queued) and parsed batches wait for at most
+        # `batches_window` pending saves, so the slowest stage applies
+        # backpressure to the ones before it.
+        self.rows = RowBuffer()
+        self.batch_start = None
+        self.fetch_failed = False
+        self.save_failed = False
+
+        range_size = self.seq_chunk if self.fetch_mode == 'seq' else 1
+        blocks = asyncio.Queue(maxsize=max(self.window // range_size, 1))
+        batches = asyncio.Queue(maxsize=self.batches_window)
+        fetching = asyncio.create_task(self.fetch_stage(session, blocks))
+        stages = [
+            asyncio.create_task(self.parse_stage(blocks, batches)),
+            asyncio.create_task(self.save_stage(batches))
+        ]
+        try:
+            await asyncio.gather(*stages)
         finally:
-            self.transactions_inserted = 0
-            self.sql_data_transactions = []
-            self.sql_data_proofs = []
-            self.sql_data_tables = []
-            self.sql_data_columns = []
-            self.sql_data_values = []
+            fetching.cancel()
+            for stage in stages:
+                stage.cancel()
+            # Fetches queued behind a failed one would otherwise keep
+            # running, IPFS requests included, alongside the next pass.
+            while not blocks.empty():
+                item = blocks.get_nowait()
+                if item is not None:
+                    item[2].cancel()
+
+    async def retry_attachments(self, session):
+        entries = await self.pool.fetch("""
+            SELECT tx_id, height, ipfs_hash, tx, attempts FROM ipfs_retries
+            WHERE expired_at IS NULL AND next_attempt_at <= now()
+            ORDER BY next_attempt_at
+            LIMIT $1
+        """, self.retry_batch)
+        if not entries:
+            return
+
+        attachments = await asyncio.gather(*[self.fetch_attachment(entry['ipfs_hash'], session) for entry in entries])
+        resolved = [(entry, attachment) for entry, attachment in zip(entries, attachments) if attachment is not None]
+        failed = [entry for entry, attachment in zip(entries, attachments) if attachment is None]
+        expired = [entry['tx_id'] for entry in failed if entry['attempts'] + 1 >= self.retry_max_attempts]
+
+        batch = RowBuffer()
+        retried = [(entry['height'], pjson.loads(entry['tx']), attachment) for entry, attachment in resolved]
+        batch.extend(await asyncio.get_running_loop().run_in_executor(None, retry_rows, retried))
+
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await save_batch(conn, batch)
+                await conn.execute("DELETE FROM ipfs_retries WHERE tx_id = ANY($1::varchar[])", [entry['tx_id'] for entry, _ in resolved])
+                # Entries out of attempts stay in the table for inspection
+                # but are never fetched again.
+                await conn.execute("""
+                    UPDATE ipfs_retries SET
+                        attempts = attempts + 1,
+                        next_attempt_at = now() + least($2 * power(2, attempts), $3) * interval '1 second',
+                        expired_at = CASE WHEN attempts + 1 >= $4 THEN now() END
+                    WHERE tx_id = ANY($1::varchar[])
+                """, [entry['tx_id'] for entry in failed], self.retry_base_delay, self.retry_max_delay, self.retry_max_attempts)
+
+        self.metrics.inc('ipfsRetriesResolved', len(resolved))
+        self.metrics.inc('ipfsRetriesFailed', len(failed))
+        self.metrics.inc('ipfsRetriesExpired', len(expired))
+        if expired:
+            logger.warning('Gave up on {0} queued IPFS attachments after {1} attempts'.format(len(expired), self.retry_max_attempts))
+        if resolved:
+            logger.info('Resolved {0} queued IPFS attachments'.format(len(resolved)))
+
+    async def retry_loop(self):
+        # Attachments that timed out during ingestion are retried here with
+        # exponential backoff, so the main loop never waits for them.
+        async with aiohttp.ClientSession() as session:
+            while True:
+                try:
+                    await self.retry_attachments(session)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as error:
+                    logger.error('IPFS retry error: {0}'.format(error))
+                await asyncio.sleep(self.retry_interval)
+
+    async def setup(self):
+        if self.pool:
+            return
+
+        self.ipfs_semaphore = asyncio.Semaphore(self.ipfs_concurrency)
+        if self.processes > 0:
+            self.process_pool = ProcessPoolExecutor(max_workers=self.processes)
 
-    async def start(self):
-        conn = None
         try:
-            conn = psycopg2.connect(**dsn)
-        except psycopg2.OperationalError as error:
-            logger.error('Postgres Engine Error:', error)
+            self.pool = await create_pool()
+        except (OSError, asyncpg.PostgresError) as error:
+            logger.error('Postgres Engine Error: {0}'.format(error))
             await self.emergency_stop_loop('No conn error', 'Error on connection to Postgres Engine')
 
+    async def teardown(self):
+        if self.process_pool:
+            self.process_pool.shutdown()
+            self.process_pool = None
+        if self.pool:
+            await self.pool.close()
+            self.pool = None
+
+    async def start(self):
+        await self.setup()
+        asyncio.create_task(self.retry_loop())
+
         try:
-            with conn:
-                with conn.cursor() as cur:
-                    cur.execute("SELECT max(height) FROM transactions")
-                    max_height = cur.fetchone()
+            max_block = await self.pool.fetchval("SELECT max(height) FROM blocks")
+            max_height = await self.pool.fetchval("SELECT max(height) FROM transactions")
 
-                    if max_height and max_height[0]:
-                        if max_height[0] > self.blocks_to_check:
-                            self.height = max_height[0] - self.blocks_to_check
+            if max_block:
+                self.height = max_block + 1
+            elif max_height:
+                if max_height > self.blocks_to_check:
+                    self.height = max_height - self.blocks_to_check
 
-                    if os.environ['START_HEIGHT']:
-                        start_height = int(os.environ['START_HEIGHT'])
-                        if self.height < start_height:
-                            self.height = start_height
+            if os.environ['START_HEIGHT']:
+                self.start_height = int(os.environ['START_HEIGHT'])
+                if self.height < self.start_height:
+                    self.height = self.start_height
+
+            self.resume_height = self.height
 
-        
         except Exception as error:
             logger.error('Max height request error: {}'.format(error))
             await self.emergency_stop_loop('Max height request error', error)
 
-        while True:
-            try:
-                req = requests.get('{0}/node/status'.format(os.environ['NODE_URL']))
-                data = req.json()
-                self.last_block = int(data['blockchainHeight'])
-
-                with conn:
-                    with conn.cursor() as cur:
-                        if self.height > self.last_block:
-                            cur.execute("""
-                                DELETE FROM transactions WHERE height > '{height}'
-                            """.format(
-                                height=self.last_block
-                            ))
-                            self.height = self.last_block
-                            conn.commit()
-
-            except Exception as error:
-                await self.emergency_stop_loop('Waves node is not responding', error)
-
-            logger.info('Start height: {}, last block: {}'.format(self.height, self.last_block))
-            logger.info('-' * 40)
-            try:
-                async with aiohttp.ClientSession() as session:
-                    try:
-                        while self.height < self.last_block:
-                            t0 = time()
-                            batch = self.height + self.step
-                            if self.height + self.step >= self.last_block:
-                                batch = self.last_block + 1
-
-                            batch_range = (self.height, batch)
-                            tasks = []
-                            for i in range(batch_range[0], batch_range[1]):
-                                url = '{0}/blocks/at/{1}'.format(os.environ['NODE_URL'], self.height)
-                                task = asyncio.create_task(self.fetch_data(url, session))
-                                tasks.append(task)
-                                self.height += 1
-                            logger.info('Height range {0} - {1}'.format(batch_range[0], batch_range[1]))
-                            await asyncio.gather(*tasks)
-                            await self.save_data()
-                            logger.info('Parsing time: {0} sec'.format(time() - t0))
-                            logger.info('-' * 40)
-
-                    except asyncio.CancelledError:
-                        logger.info('Parser stopping...')
-                        raise
-                    except Exception as error:
-                        logger.error('Blocks session cycle error on height {0}: {1}'.format(self.height, error))
-                        await self.emergency_stop_loop('Blocks session cycle error', error)
-
-            except asyncio.CancelledError:
-                logger.info('Parser has been stopped')
-                raise
-            except Exception as error:
-                logger.error('Request blocks cycle error: {0}'.format(error))
-                await self.emergency_stop_loop('Request blocks cycle', error)
-            finally:
-                self.height = self.height - self.blocks_to_check
-                await asyncio.sleep(2)
+        async with aiohttp.ClientSession() as session:
+            while True:
+                try:
+                    self.last_block = await self.tip.wait(session)
+                    self.liquid_height = self.last_block
+                except asyncio.CancelledError:
+                    logger.info('Parser has been stopped')
+                    raise
+                except Exception as error:
+                    await self.emergency_stop_loop('Waves node is not responding', error)
+
+                try:
+                    checked_height, fork_point = await self.find_fork_point(session)
+                    if fork_point is None:
+                        self.height = self.resume_height
+                    else:
+                        if fork_point < checked_height:
+                            logger.info('Fork detected, rolling back to height {0}'.format(fork_point))
+                            await self.rollback(fork_point)
+                        self.height = max(fork_point + 1, self.start_height)
+
+                    logger.info('Start height: {}, last block: {}'.format(self.height, self.last_block))
+                    logger.info('-' * 40)
+                    await self.run_pipeline(session)
+
+                    if self.fetch_failed:
+                        # Retry the unfinished range without waiting for the
+                        # next block.
+                        self.tip.reset()
+                        await asyncio.sleep(self.tip.min_interval)
+
+                except asyncio.CancelledError:
+                    logger.info('Parser has been stopped')
+                    raise
+                except Exception as error:
+                    logger.error('Blocks session cycle error on height {0}: {1}'.format(self.height, error))
+                    await self.emergency_stop_loop('Blocks session cycle error', error)
 
 
 controls = Parser()
@@ -390,6 +558,17 @@ def gentle_exit(app, loop):
     logger.info('Killing the process')
     os.kill(os.getpid(), signal.SIGKILL)
 
+@parser.route('/metrics', methods=['GET'])
+def parser_metrics(request):
+    data = controls.metrics.to_dict()
+    data.update({
+        'height': controls.height,
+        'savedHeight': controls.saved_height,
+        'lastBlock': controls.last_block,
+        'lag': max(controls.last_block - controls.height, 0) if controls.last_block else None
+    })
+    return json(data)
+
 @parser.route('/healthcheck', methods=['GET'])
 def container_healthcheck(request):
     return json({"action": "healthcheck", "status": "OK"})
@@ -0,0 +1,109 @@
+import os
+import json
+import hashlib
+import uuid
+from time import time
+from datetime import datetime
+from sanic.log import logger
+from .cdm import decode
+from .utils import verify_transfer
+from .buffer import encode_rows
+
+
+def empty_rows():
+    return {
+        'blocks': [],
+        'transactions': [],
+        'proofs': [],
+        'tables': [],
+        'columns': [],
+        'values': [],
+        'ipfs_retries': []
+    }
+
+
+def tx_rows(tx, height, cnfy_id, attachment, rows):
+    attachment_hash = hashlib.sha256(attachment.encode('utf-8')).hexdigest()
+
+    cdm = decode(attachment)
+    if str(cdm.version) != str(os.environ['CDM_VERSION']):
+        return
+
+    for op in cdm.tables:
+        rows['tables'].append((op.hash, tx['id'], op.ciphertext, op.recipient))
+    for op in cdm.columns:
+        rows['columns'].append((op.hash, op.table_hash, op.ciphertext, op.recipient))
+    for op in cdm.values:
+        rows['values'].append((op.hash, op.col_hash, op.ciphertext, op.col_ciphertext, op.recipient))
+
+    tx_data = (
+        tx['id'],
+        height,
+        tx['type'],
+        tx['sender'],
+        tx['senderPublicKey'],
+        tx['recipient'],
+        tx['amount'],
+        tx['assetId'],
+        tx['feeAssetId'],
+        tx['feeAsset'],
+        tx['fee'],
+        tx['attachment'],
+        tx['version'],
+        datetime.fromtimestamp(tx['timestamp'] / 1e3),
+        cnfy_id,
+        attachment_hash,
+        verify_transfer(tx)
+    )
+
+    rows['transactions'].append(tx_data)
+
+    for proof in tx['proofs']:
+        proof_id = 'proof-' + str(uuid.uuid4())
+        rows['proofs'].append((tx['id'], proof, proof_id))
+
+
+def block_rows(block, liquid_height=None):
+    # One block's rows, encoded for the row buffer.
+    header, txs, ipfs_hashes, attachments = block
+    height = header[0]
+    rows = empty_rows()
+    cnfy_id = 'cnfy-{}'.format(str(uuid.uuid4()))
+    # The liquid block's transactions are saved, but it is only recorded
+    # in blocks once a later key block has sealed it.
+    if height != liquid_height:
+        rows['blocks'].append(header)
+
+    try:
+        for tx, ipfs_hash, attachment in zip(txs, ipfs_hashes, attachments):
+            if attachment == None:
+                logger.warning('Queueing IPFS hash {0} for retry'.format(ipfs_hash))
+                rows['ipfs_retries'].append((tx['id'], height, ipfs_hash, json.dumps(tx)))
+                continue
+
+            tx_rows(tx, height, cnfy_id, attachment, rows)
+
+    except Exception as error:
+        logger.error('Parsing data error on height {0}: {1}'.format(height, error))
+    return encode_rows(rows)
+
+
+def blocks_rows(blocks, liquid_height=None):
+    # Runs either inline or in a worker process, so it only takes and
+    # returns plain picklable data: a (height, encoded rows) chunk per
+    # block, so the parser can cut batches between blocks, and the time
+    # spent on them.
+    t0 = time()
+    chunks = [(block[0][0], block_rows(block, liquid_height)) for block in blocks]
+    return chunks, time() - t0
+
+
+def retry_rows(entries):
+    rows = empty_rows()
+    cnfy_id = 'cnfy-{}'.format(str(uuid.uuid4()))
+    for height, tx, attachment in entries:
+        try:
+            tx_rows(tx, height, cnfy_id, attachment, rows)
+        except Exception as error:
+            logger.error('Parsing retried transaction {0} error: {1}'.format(tx['id'], error))
+    return encode_rows(rows)
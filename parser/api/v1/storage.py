@@ -0,0 +1,109 @@
+import os
+import json
+import asyncpg
+import configparser
+
+config = configparser.ConfigParser()
+config.read('config.ini')
+
+dsn = {
+    "user": os.environ['POSTGRES_USER'],
+    "password": os.environ['POSTGRES_PASSWORD'],
+    "database": os.environ['POSTGRES_DB'],
+    "host": config['DB']['host'],
+    "port": config['DB']['port'],
+    "sslmode": config['DB']['sslmode'],
+    "target_session_attrs": config['DB']['target_session_attrs']
+}
+
+# (table, columns, conflict clause, distinct on) in insertion order. Rows are
+# COPYed into a session temp table and merged with INSERT ... SELECT, so a
+# batch costs one round trip per table regardless of its size.
+TABLES = [
+    ('blocks', ['height', 'signature', 'reference'],
+        'ON CONFLICT (height) DO UPDATE SET signature = EXCLUDED.signature, reference = EXCLUDED.reference', 'height'),
+    ('transactions', [
+        'id',
+        'height',
+        'type',
+        'sender',
+        'sender_public_key',
+        'recipient',
+        'amount',
+        'asset_id',
+        'fee_asset_id',
+        'fee_asset',
+        'fee',
+        'attachment',
+        'version',
+        'timestamp',
+        'cnfy_id',
+        'attachment_hash',
+        'verified'
+    ], 'ON CONFLICT (id) DO UPDATE SET height = EXCLUDED.height, verified = EXCLUDED.verified', 'id'),
+    ('proofs', ['tx_id', 'proof', 'id'], 'ON CONFLICT DO NOTHING', None),
+    ('tables', ['hash', 'tx_id', 'ciphertext', 'recipient'], 'ON CONFLICT DO NOTHING', None),
+    ('columns', ['hash', 'table_hash', 'ciphertext', 'recipient'], 'ON CONFLICT DO NOTHING', None),
+    ('values', ['val_hash', 'col_hash', 'val_ciphertext', 'col_ciphertext', 'recipient'], 'ON CONFLICT DO NOTHING', None),
+    ('ipfs_retries', ['tx_id', 'height', 'ipfs_hash', 'tx'], 'ON CONFLICT DO NOTHING', None)
+]
+
+# Public keys touched by a batch, announced on NOTIFY_CHANNEL once the
+# batch commits. Payloads are capped at 8000 bytes by Postgres, so keys go
+# out in chunks.
+NOTIFY_CHANNEL = 'nolikdb_batches'
+NOTIFY_KEYS = 100
+KEY_COLUMNS = {
+    'transactions': 'sender_public_key',
+    'tables': 'recipient',
+    'columns': 'recipient',
+    'values': 'recipient'
+}
+
+
+async def create_pool():
+    return await asyncpg.create_pool(
+        user=dsn['user'],
+        password=dsn['password'],
+        database=dsn['database'],
+        host=dsn['host'],
+        port=int(dsn['port']),
+        ssl=dsn['sslmode'],
+        min_size=int(config['DB']['pool_min_size']),
+        max_size=int(config['DB']['pool_max_size'])
+    )
+
+
+async def copy_merge(conn, table, columns, data, conflict, distinct_on=None):
+    staging = 'staging_{0}'.format(table)
+    await conn.execute('CREATE TEMP TABLE IF NOT EXISTS {0} (LIKE "{1}" INCLUDING DEFAULTS) ON COMMIT DELETE ROWS'.format(staging, table))
+    await conn.copy_to_table(staging, source=data, columns=columns, format='csv')
+
+    fields = ', '.join(columns)
+    distinct = 'DISTINCT ON ({0}) '.format(distinct_on) if distinct_on else ''
+    status = await conn.execute('INSERT INTO "{0}" ({1}) SELECT {2}{1} FROM {3} {4}'.format(table, fields, distinct, staging, conflict))
+    return int(status.split()[-1])
+
+
+async def save_batch(conn, batch):
+    transactions_inserted = 0
+    async with conn.transaction():
+        for table, columns, conflict, distinct_on in TABLES:
+            if batch.count(table) == 0:
+                continue
+
+            count = await copy_merge(conn, table, columns, batch.data(table), conflict, distinct_on)
+            if table == 'transactions':
+                transactions_inserted = count
+
+        await notify_batch(conn, batch)
+
+    return transactions_inserted
+
+
+async def notify_batch(conn, batch):
+    # NOTIFY is delivered only when the surrounding transaction commits.
+    keys = sorted(batch.keys)
+    for i in range(0, len(keys), NOTIFY_KEYS):
+        payload = json.dumps({'heights': batch.heights, 'publicKeys': keys[i:i + NOTIFY_KEYS]})
+        await conn.execute('SELECT pg_notify($1, $2)', NOTIFY_CHANNEL, payload)
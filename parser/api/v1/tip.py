@@ -0,0 +1,35 @@
+import asyncio
+import json as pjson
+
+
+class TipFollower:
+    # The node's REST API has no push or long-poll endpoint for new blocks,
+    # so the tip is polled on /blocks/headers/last. The interval starts at
+    # min_interval right after a change and doubles up to max_interval
+    # while the chain is idle. The tip is identified by (height, id), so
+    # microblocks extending the liquid block wake the parser as well; the
+    # parser re-reads that block instead of treating the new id as a fork.
+    def __init__(self, node_url, min_interval, max_interval):
+        self.node_url = node_url
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.tip = None
+
+    async def poll(self, session):
+        async with session.get('{0}/blocks/headers/last'.format(self.node_url)) as response:
+            header = pjson.loads(await response.text())
+        return int(header['height']), header.get('id') or header['signature']
+
+    def reset(self):
+        self.tip = None
+
+    async def wait(self, session):
+        interval = self.min_interval
+        while True:
+            tip = await self.poll(session)
+            if tip != self.tip:
+                self.tip = tip
+                return tip[0]
+
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, self.max_interval)
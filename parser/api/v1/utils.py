@@ -1,6 +1,9 @@
 import base58
 import base64
+import hashlib
 import os
+import threading
+from collections import OrderedDict
 import pywaves.crypto as crypto
 import axolotl_curve25519 as curve
 
@@ -22,4 +25,76 @@ def verify_signature(m_public_key, signature, message):
     
     verified = curve.verifySignature(public_key_bytes, message.encode(), signature_bytes) == 0
 
-    return  verified
\ No newline at end of file
+    return  verified
+
+
+VERIFIED_CACHE_SIZE = 100000
+verified_cache = OrderedDict()
+verified_lock = threading.Lock()
+
+
+def long_bytes(value):
+    return value.to_bytes(8, byteorder='big')
+
+
+def short_bytes(data):
+    return len(data).to_bytes(2, byteorder='big') + data
+
+
+def asset_bytes(asset_id):
+    if asset_id:
+        return b'\x01' + base58.b58decode(asset_id)
+    return b'\x00'
+
+
+def recipient_bytes(recipient):
+    if recipient.startswith('alias:'):
+        _, chain_id, alias = recipient.split(':', 2)
+        return b'\x02' + chain_id.encode('utf-8') + short_bytes(alias.encode('utf-8'))
+    return base58.b58decode(recipient)
+
+
+def transfer_body(tx):
+    # Signed bytes of transfer v1 and v2. Later versions are protobuf
+    # encoded and are left unverified.
+    if tx['version'] not in [1, 2]:
+        return None
+
+    body = b''.join([
+        base58.b58decode(tx['senderPublicKey']),
+        asset_bytes(tx['assetId']),
+        asset_bytes(tx['feeAssetId']),
+        long_bytes(tx['timestamp']),
+        long_bytes(tx['amount']),
+        long_bytes(tx['fee']),
+        recipient_bytes(tx['recipient']),
+        short_bytes(base58.b58decode(tx['attachment']))
+    ])
+    return (b'\x04' if tx['version'] == 1 else b'\x04\x02') + body
+
+
+def verify_transfer(tx):
+    # Results are memoised by (public key, signature, body hash) and the
+    # least recently used ones evicted, so blocks parsed again after a
+    # rollback or a backfill retry are not re-verified. Called from parser
+    # executor threads, hence the lock.
+    body = transfer_body(tx)
+    if body is None or not tx['proofs']:
+        return None
+
+    key = (tx['senderPublicKey'], tx['proofs'][0], hashlib.sha256(body).digest())
+    with verified_lock:
+        verified = verified_cache.get(key)
+        if verified is not None:
+            verified_cache.move_to_end(key)
+            return verified
+
+    public_key_bytes = base58.b58decode(tx['senderPublicKey'])
+    signature_bytes = base58.b58decode(tx['proofs'][0])
+    verified = curve.verifySignature(public_key_bytes, body, signature_bytes) == 0
+
+    with verified_lock:
+        verified_cache[key] = verified
+        if len(verified_cache) > VERIFIED_CACHE_SIZE:
+            verified_cache.popitem(last=False)
+    return verified
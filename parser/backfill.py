@@ -0,0 +1,95 @@
+# Historical backfill for fresh deployments.
+#
+# Splits [START_HEIGHT, tip - tip_margin] into ranges, ingests them
+# concurrently and records every completed range in backfill_ranges, so an
+# interrupted run only redoes unfinished ranges. Once everything is covered
+# it starts the regular parser server, which resumes right after the last
+# stored block. Run it instead of server.py:
+#
+#   python3.7 backfill.py
+
+import os
+import copy
+import asyncio
+import aiohttp
+import configparser
+from sanic.log import logger
+from api.v1.parser import Parser
+import server
+
+config = configparser.ConfigParser()
+config.read('config.ini')
+
+
+def pending_ranges(first_height, last_height, completed, range_size):
+    pending = []
+    height = first_height
+    for done_first, done_last in sorted(completed):
+        if done_last < height:
+            continue
+        if done_first > last_height:
+            break
+        if done_first > height:
+            pending.append((height, done_first - 1))
+        height = max(height, done_last + 1)
+    if height <= last_height:
+        pending.append((height, last_height))
+
+    ranges = []
+    for first, last in pending:
+        for start in range(first, last + 1, range_size):
+            ranges.append((start, min(start + range_size - 1, last)))
+    return ranges
+
+
+async def backfill_range(parser, session, first_height, last_height):
+    worker = copy.copy(parser)
+    worker.height = first_height
+    worker.last_block = last_height
+    worker.saved_height = None
+    await worker.run_pipeline(session)
+
+    if worker.saved_height != last_height:
+        logger.warning('Backfill range {0} - {1} stopped at {2}'.format(first_height, last_height, worker.saved_height))
+        return
+
+    await parser.pool.execute("""
+        INSERT INTO backfill_ranges (first_height, last_height) VALUES ($1, $2)
+        ON CONFLICT DO NOTHING
+    """, first_height, last_height)
+    logger.info('Backfill range {0} - {1} completed'.format(first_height, last_height))
+
+
+async def backfill_worker(parser, session, ranges):
+    while ranges:
+        first_height, last_height = ranges.pop(0)
+        await backfill_range(parser, session, first_height, last_height)
+
+
+async def backfill(parser):
+    await parser.setup()
+    start_height = int(os.environ['START_HEIGHT'] or 1)
+    workers = int(config['backfill']['workers'])
+    range_size = int(config['backfill']['range_size'])
+
+    async with aiohttp.ClientSession() as session:
+        status = await parser.fetch_json('{0}/node/status'.format(os.environ['NODE_URL']), session)
+        target_height = int(status['blockchainHeight']) - int(config['backfill']['tip_margin'])
+
+        while True:
+            completed = await parser.pool.fetch("SELECT first_height, last_height FROM backfill_ranges")
+            ranges = pending_ranges(start_height, target_height, [tuple(r) for r in completed], range_size)
+            if not ranges:
+                break
+
+            logger.info('Backfilling {0} ranges up to height {1}'.format(len(ranges), target_height))
+            await asyncio.gather(*[backfill_worker(parser, session, ranges) for _ in range(workers)])
+            await asyncio.sleep(2)
+
+    await parser.teardown()
+    logger.info('Backfill completed up to height {0}'.format(target_height))
+
+
+if __name__ == "__main__":
+    asyncio.get_event_loop().run_until_complete(backfill(Parser()))
+    server.run()
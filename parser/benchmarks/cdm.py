@@ -0,0 +1,115 @@
+# Compares the CDM decoder with the findall based parsing it
+# replaced, on synthetic create and insert CDMs.
+#
+#   docker exec -it nolikdb-parser python3.7 -m benchmarks.cdm --columns 500
+
+import argparse
+import uuid
+import timeit
+import xml.etree.ElementTree as ET
+
+from api.v1.cdm import decode
+
+
+def generate_cdm(operation, columns, version='0.1.1'):
+    cols = []
+    for _ in range(columns):
+        value = ''
+        if operation == 'insert':
+            value = '<value><ciphertext>{0}</ciphertext><sha256>{1}</sha256></value>'.format(
+                uuid.uuid4().hex * 4, uuid.uuid4().hex)
+        cols.append('<column><ciphertext>{0}</ciphertext><sha256>{1}</sha256>{2}</column>'.format(
+            uuid.uuid4().hex * 2, uuid.uuid4().hex, value))
+
+    return '''<?xml version="1.0"?>
+<cdm>
+    <version>{5}</version>
+    <blockchain>waves</blockchain>
+    <network>testnet</network>
+    <operations>
+        <{0}>
+            <recipient><publickey>{1}</publickey></recipient>
+            <table><ciphertext>{2}</ciphertext><sha256>{3}</sha256></table>
+            <columns>{4}</columns>
+        </{0}>
+    </operations>
+</cdm>'''.format(operation, uuid.uuid4().hex, uuid.uuid4().hex * 2, uuid.uuid4().hex, ''.join(cols), version)
+
+
+def legacy_decode(attachment):
+    tables, columns, values = [], [], []
+    root = ET.fromstring(attachment)
+    version = root.findall('version')[0].text if len(root.findall('version')) > 0 else None
+    operations = root.findall('operations')[0] if len(root.findall('operations')) > 0 else []
+
+    operation_create = operations.findall('create')[0] if len(operations.findall('create')) > 0 else None
+    operation_insert = operations.findall('insert')[0] if len(operations.findall('insert')) > 0 else None
+    if (operation_create):
+        table_sha256hash = None
+        table = operation_create.findall('table')[0] if len(operation_create.findall('table')) > 0 else None
+        recipient_public_key = None
+        recipient = operation_create.findall('recipient')[0] if len(operation_create.findall('recipient')) > 0 else None
+        if recipient:
+            recipient_public_key = recipient.findall('publickey')[0].text if len(recipient.findall('publickey')) > 0 else None
+        if table:
+            table_ciphertext = table.findall('ciphertext')[0].text if len(table.findall('ciphertext')) > 0 else None
+            table_sha256hash = table.findall('sha256')[0].text if len(table.findall('sha256')) > 0 else None
+            tables.append((table_sha256hash, table_ciphertext, recipient_public_key))
+
+        cols = operation_create.findall('columns')[0] if len(operation_create.findall('columns')) > 0 else None
+        if cols:
+            for col in cols.findall('column'):
+                if col:
+                    col_ciphertext = col.findall('ciphertext')[0].text if len(col.findall('ciphertext')) > 0 else None
+                    col_sha256hash = col.findall('sha256')[0].text if len(col.findall('sha256')) > 0 else None
+                    columns.append((col_sha256hash, table_sha256hash, col_ciphertext, recipient_public_key))
+
+    if (operation_insert):
+        recipient_public_key = None
+        recipient = operation_insert.findall('recipient')[0] if len(operation_insert.findall('recipient')) > 0 else None
+        if recipient:
+            recipient_public_key = recipient.findall('publickey')[0].text if len(recipient.findall('publickey')) > 0 else None
+        cols = operation_insert.findall('columns')[0] if len(operation_insert.findall('columns')) > 0 else None
+        if cols:
+            for col in cols.findall('column'):
+                val_ciphertext = None
+                val_sha256hash = None
+                if col:
+                    col_ciphertext = col.findall('ciphertext')[0].text if len(col.findall('ciphertext')) > 0 else None
+                    col_sha256hash = col.findall('sha256')[0].text if len(col.findall('sha256')) > 0 else None
+                    value = col.findall('value')[0] if len(col.findall('value')) > 0 else None
+                    if value:
+                        val_ciphertext = value.findall('ciphertext')[0].text if len(value.findall('ciphertext')) > 0 else None
+                        val_sha256hash = value.findall('sha256')[0].text if len(value.findall('sha256')) > 0 else None
+                    values.append((val_sha256hash, col_sha256hash, val_ciphertext, col_ciphertext, recipient_public_key))
+
+    return version, tables, columns, values
+
+
+def decode_rows(attachment):
+    cdm = decode(attachment)
+    return (
+        cdm.version,
+        [(op.hash, op.ciphertext, op.recipient) for op in cdm.tables],
+        [(op.hash, op.table_hash, op.ciphertext, op.recipient) for op in cdm.columns],
+        [(op.hash, op.col_hash, op.ciphertext, op.col_ciphertext, op.recipient) for op in cdm.values]
+    )
+
+
+def main():
+    args = argparse.ArgumentParser()
+    args.add_argument('--columns', type=int, default=300)
+    args.add_argument('--number', type=int, default=50)
+    args = args.parse_args()
+
+    for operation in ['create', 'insert']:
+        attachment = generate_cdm(operation, args.columns)
+        assert legacy_decode(attachment) == decode_rows(attachment)
+
+        for name, run in [('findall', legacy_decode), ('decoder', decode_rows)]:
+            elapsed = min(timeit.repeat(lambda: run(attachment), number=args.number, repeat=3)) / args.number
+            print('{0:>7} {1:>12}: {2:.3f} ms per CDM'.format(operation, name, elapsed * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+# Compares ways of turning a /blocks/seq response into our transactions:
+# json.loads on text (the old path), orjson on raw bytes, and orjson with
+# the raw asset prefilter that skips responses without our asset. Uses a
+# recorded response when given, otherwise generates busy blocks where only
+# a small share of transfers are CDM transactions.
+#
+#   curl $NODE_URL/blocks/seq/1200000/1200099 > blocks.json
+#   docker exec -it nolikdb-parser python3.7 -m benchmarks.decode --recorded blocks.json
+
+import os
+import json
+import uuid
+import random
+import timeit
+import argparse
+
+import orjson
+
+ASSET_ID = os.environ.get('ASSET_ID', 'bench-asset')
+
+
+def generate_tx(asset_id):
+    return {
+        'type': 4,
+        'id': uuid.uuid4().hex,
+        'sender': '3N' + uuid.uuid4().hex,
+        'senderPublicKey': uuid.uuid4().hex,
+        'fee': 100000,
+        'timestamp': 1550000000000,
+        'proofs': [uuid.uuid4().hex * 2],
+        'version': 2,
+        'recipient': '3N' + uuid.uuid4().hex,
+        'assetId': asset_id,
+        'feeAssetId': asset_id,
+        'feeAsset': asset_id,
+        'amount': 1,
+        'attachment': uuid.uuid4().hex
+    }
+
+
+def generate_blocks(blocks, txs, ours):
+    data = []
+    for height in range(1, blocks + 1):
+        transactions = [generate_tx(ASSET_ID if random.random() < ours else None) for _ in range(txs)]
+        data.append({
+            'height': height,
+            'signature': uuid.uuid4().hex,
+            'reference': uuid.uuid4().hex,
+            'transactions': transactions
+        })
+    return json.dumps(data).encode('utf-8')
+
+
+def filter_txs(data):
+    return [
+        [tx for tx in block['transactions'] if tx['type'] == 4 and tx.get('feeAssetId') == ASSET_ID]
+        for block in data
+    ]
+
+
+def legacy(raw):
+    return filter_txs(json.loads(raw.decode('utf-8')))
+
+
+def fast(raw):
+    return filter_txs(orjson.loads(raw))
+
+
+def prefiltered(raw):
+    if ASSET_ID.encode('utf-8') not in raw:
+        return None
+    return fast(raw)
+
+
+def main():
+    args = argparse.ArgumentParser()
+    args.add_argument('--recorded', help='/blocks/seq response recorded from a node')
+    args.add_argument('--blocks', type=int, default=100)
+    args.add_argument('--txs', type=int, default=1000, help='transactions per generated block')
+    args.add_argument('--ours', type=float, default=0.01, help='share of generated transactions with our asset')
+    args.add_argument('--number', type=int, default=10)
+    args = args.parse_args()
+
+    if args.recorded:
+        with open(args.recorded, 'rb') as f:
+            raw = f.read()
+    else:
+        raw = generate_blocks(args.blocks, args.txs, args.ours)
+
+    assert legacy(raw) == fast(raw)
+    print('{0:.1f} MB, {1} of our transactions'.format(len(raw) / 2 ** 20, sum(len(txs) for txs in legacy(raw))))
+
+    for name, run in [('json', legacy), ('orjson', fast), ('prefilter', prefiltered)]:
+        elapsed = min(timeit.repeat(lambda: run(raw), number=args.number, repeat=3)) / args.number
+        print('{0:>10}: {1:.3f} ms per response, {2:.0f} MB/sec'.format(name, elapsed * 1000, len(raw) / 2 ** 20 / elapsed))
+
+
+if __name__ == '__main__':
+    main()
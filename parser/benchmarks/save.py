@@ -0,0 +1,103 @@
+# Compares the batch write paths against the configured database.
+# Every run is rolled back, so it is safe to point at a live database.
+#
+#   docker exec -it nolikdb-parser python3.7 -m benchmarks.save --txs 5000
+
+import argparse
+import asyncio
+import uuid
+from datetime import datetime
+from time import time
+
+import asyncpg
+import psycopg2
+from psycopg2.extras import execute_values
+
+from api.v1.storage import dsn, TABLES, save_batch
+from api.v1.buffer import RowBuffer, encode_rows
+
+
+def generate_rows(txs, values_per_tx):
+    batch = {table: [] for table, _, _, _ in TABLES}
+    height = 10 ** 9
+    batch['blocks'].append((height, 'bench-{0}'.format(uuid.uuid4()), None))
+    for _ in range(txs):
+        tx_id = 'bench-{0}'.format(uuid.uuid4())
+        table_hash = uuid.uuid4().hex
+        batch['transactions'].append((
+            tx_id, height, 4, 'sender', 'sender_public_key', 'recipient', 1, None, 'asset', 'asset',
+            100000, 'attachment', 2, datetime.now(), 'cnfy-{0}'.format(uuid.uuid4()), uuid.uuid4().hex, True
+        ))
+        batch['proofs'].append((tx_id, uuid.uuid4().hex, 'proof-{0}'.format(uuid.uuid4())))
+        batch['tables'].append((table_hash, tx_id, 'ciphertext', 'recipient'))
+        for _ in range(values_per_tx):
+            col_hash = uuid.uuid4().hex
+            batch['columns'].append((col_hash, table_hash, 'ciphertext', 'recipient'))
+            batch['values'].append((uuid.uuid4().hex, col_hash, 'ciphertext', 'ciphertext', 'recipient'))
+    return batch
+
+
+def generate_batch(rows):
+    batch = RowBuffer()
+    batch.extend(encode_rows(rows))
+    return batch
+
+
+def execute_values_path(rows):
+    conn = psycopg2.connect(**dsn)
+    try:
+        t0 = time()
+        with conn.cursor() as cur:
+            for table, columns, conflict, _ in TABLES:
+                if rows[table]:
+                    sql = 'INSERT INTO "{0}" ({1}) VALUES %s {2}'.format(table, ', '.join(columns), conflict)
+                    execute_values(cur, sql, rows[table])
+        elapsed = time() - t0
+        conn.rollback()
+    finally:
+        conn.close()
+    return elapsed
+
+
+async def copy_path(batch):
+    conn = await asyncpg.connect(
+        user=dsn['user'],
+        password=dsn['password'],
+        database=dsn['database'],
+        host=dsn['host'],
+        port=int(dsn['port']),
+        ssl=dsn['sslmode']
+    )
+    try:
+        tr = conn.transaction()
+        await tr.start()
+        t0 = time()
+        await save_batch(conn, batch)
+        elapsed = time() - t0
+        await tr.rollback()
+    finally:
+        await conn.close()
+    return elapsed
+
+
+def main():
+    args = argparse.ArgumentParser()
+    args.add_argument('--txs', type=int, default=1000)
+    args.add_argument('--values', type=int, default=10)
+    args.add_argument('--repeat', type=int, default=5)
+    args = args.parse_args()
+
+    rows = generate_rows(args.txs, args.values)
+    batch = generate_batch(rows)
+
+    loop = asyncio.get_event_loop()
+    for name, run in [
+        ('execute_values', lambda: execute_values_path(rows)),
+        ('copy + merge', lambda: loop.run_until_complete(copy_path(batch)))
+    ]:
+        best = min(run() for _ in range(args.repeat))
+        print('{0:>16}: {1:.3f} sec, {2:.0f} rows/sec'.format(name, best, batch.rows / best))
+
+
+if __name__ == '__main__':
+    main()
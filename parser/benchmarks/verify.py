@@ -0,0 +1,112 @@
+# Checks transfer_body/verify_transfer against signed transfer v1 and v2
+# transactions and times verification with and without the memo cache.
+# The fixtures are signed with a fixed test key over the TransferTransaction
+# v1/v2 layout, built here field by field as PyWaves' sendAsset does;
+# signatures recorded from the node can be added to TRANSFERS as they are.
+#
+#   docker exec -it nolikdb-parser python3.7 -m benchmarks.verify --count 2000
+
+import copy
+import struct
+import argparse
+from time import time
+
+import base58
+
+from api.v1 import utils
+from api.v1.utils import transfer_body, verify_transfer
+
+SENDER_PUBLIC_KEY = 'EXNTQDxJ1Hq7Y38U3nJfqD996fyqGG7MQ4RzjggY6Xzz'
+ASSET_ID = '8TNxBS39CC7Jn9jXrMsU31kBp4WETGUPEJGVhFuZjbor'
+RECIPIENT = '3MrQFGmW2cv6pzQDwLDXf96JibSoAqkW9oU'
+ATTACHMENT = '9tmw914oqwtwrzcbgzTd3yCBzL87SwJNetGdUFpbizYDjciYfDMHCXBhiTnJRc2'
+
+TRANSFERS = [
+    {
+        'type': 4,
+        'version': 1,
+        'id': 'check-v1',
+        'senderPublicKey': SENDER_PUBLIC_KEY,
+        'assetId': ASSET_ID,
+        'feeAssetId': ASSET_ID,
+        'timestamp': 1570000000000,
+        'amount': 1,
+        'fee': 100000,
+        'recipient': RECIPIENT,
+        'attachment': ATTACHMENT,
+        'proofs': ['4pGKNQzbuq7fY4jjWJco7YtDqtc2PnJTGUqTPVofg2tLGKABCVoQpt2vNTqZNVsgAPLAnzUMUBtoTSadJbmFNM1H']
+    },
+    {
+        'type': 4,
+        'version': 2,
+        'id': 'check-v2',
+        'senderPublicKey': SENDER_PUBLIC_KEY,
+        'assetId': ASSET_ID,
+        'feeAssetId': ASSET_ID,
+        'timestamp': 1570000001000,
+        'amount': 1,
+        'fee': 100000,
+        'recipient': RECIPIENT,
+        'attachment': ATTACHMENT,
+        'proofs': ['3o652PqqcCh4tpvddcDeXB71oqMtvdtDztDFo3q4fjkYmDXYVWvNw8gqxGkXxwZfJm9qESs3Rz2CRMC8zgD3V6jP']
+    }
+]
+
+
+def spec_body(tx):
+    prefix = b'\x04' if tx['version'] == 1 else b'\x04\x02'
+    attachment = base58.b58decode(tx['attachment'])
+    return b''.join([
+        prefix,
+        base58.b58decode(tx['senderPublicKey']),
+        b'\x01' + base58.b58decode(tx['assetId']),
+        b'\x01' + base58.b58decode(tx['feeAssetId']),
+        struct.pack('>Q', tx['timestamp']),
+        struct.pack('>Q', tx['amount']),
+        struct.pack('>Q', tx['fee']),
+        base58.b58decode(tx['recipient']),
+        struct.pack('>H', len(attachment)),
+        attachment
+    ])
+
+
+def check():
+    for tx in TRANSFERS:
+        assert transfer_body(tx) == spec_body(tx), 'v{0} body differs from the spec layout'.format(tx['version'])
+        assert verify_transfer(tx) is True, 'v{0} signature does not verify'.format(tx['version'])
+
+        tampered = copy.deepcopy(tx)
+        tampered['amount'] += 1
+        assert verify_transfer(tampered) is False, 'tampered v{0} transfer verifies'.format(tx['version'])
+
+        unsupported = dict(tx, version=3)
+        assert verify_transfer(unsupported) is None
+    print('v1 and v2 transfers verify, tampered ones do not')
+
+
+def timed(count, cached):
+    txs = [dict(TRANSFERS[i % 2], amount=i // 2 + 1) for i in range(count)]
+    if cached:
+        for tx in txs:
+            verify_transfer(tx)
+
+    t0 = time()
+    for tx in txs:
+        verify_transfer(tx)
+    return time() - t0
+
+
+def main():
+    args = argparse.ArgumentParser()
+    args.add_argument('--count', type=int, default=2000)
+    args = args.parse_args()
+
+    check()
+    for name, cached in [('cold', False), ('cached', True)]:
+        utils.verified_cache.clear()
+        elapsed = timed(args.count, cached)
+        print('{0:>8}: {1:.3f} sec, {2:.1f} us per transfer'.format(name, elapsed, elapsed / args.count * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -9,7 +9,7 @@ config.read('config.ini')
 app = Sanic('nolik_parser')
 app.blueprint(api_v1)
 
-if __name__ == "__main__":
+def run():
     env = os.environ['ENV']
     app.run(
         host=config['app']['host'],
@@ -17,3 +17,7 @@ if __name__ == "__main__":
         debug=env == 'development',
         workers=1
     )
+
+
+if __name__ == "__main__":
+    run()
@@ -131,3 +131,277 @@ create index if not exists senders_sender_index
 create unique index if not exists senders_sender_signature_uindex
 	on senders (sender, signature);
 
+create table if not exists blocks
+(
+	height integer not null
+		constraint blocks_pk
+			primary key,
+	signature varchar(255) not null,
+	reference varchar(255)
+);
+
+alter table blocks owner to chainify;
+
+create index if not exists transactions_height_index
+	on transactions (height);
+
+alter table transactions add column if not exists verified boolean;
+
+create table if not exists backfill_ranges
+(
+	first_height integer not null,
+	last_height integer not null,
+	completed_at timestamp default CURRENT_TIMESTAMP not null,
+	constraint backfill_ranges_pk
+		primary key (first_height, last_height)
+);
+
+alter table backfill_ranges owner to chainify;
+
+create table if not exists ipfs_retries
+(
+	tx_id varchar(255) not null
+		constraint ipfs_retries_pk
+			primary key,
+	height integer not null,
+	ipfs_hash varchar(255) not null,
+	tx jsonb not null,
+	attempts integer default 0 not null,
+	next_attempt_at timestamp default CURRENT_TIMESTAMP not null,
+	created_at timestamp default CURRENT_TIMESTAMP not null
+);
+
+alter table ipfs_retries owner to chainify;
+
+create index if not exists ipfs_retries_next_attempt_at_index
+	on ipfs_retries (next_attempt_at);
+
+alter table ipfs_retries add column if not exists expired_at timestamp;
+
+create index if not exists ipfs_retries_pending_index
+	on ipfs_retries (next_attempt_at)
+	where expired_at is null;
+
+-- threads.version and the version columns added to cdms, tables, columns
+-- and values below hold the id of the transaction that last wrote the
+-- row (txid_current()). Ids are assigned when a writer starts, not when it
+-- commits, so the API never moves a sync cursor past the oldest
+-- transaction still running (txid_snapshot_xmin).
+create table if not exists threads
+(
+	thread_hash varchar(255) not null
+		constraint threads_pk
+			primary key,
+	members varchar(255)[] not null,
+	last_timestamp timestamp,
+	last_tx_id varchar(255),
+	version bigint default txid_current() not null
+);
+
+alter table threads owner to chainify;
+
+alter table threads alter column version set default txid_current();
+
+drop sequence if exists threads_version_seq;
+
+create table if not exists thread_members
+(
+	public_key varchar(255) not null,
+	thread_hash varchar(255) not null
+		constraint thread_members_threads_thread_hash_fk
+			references threads
+				on update cascade on delete cascade,
+	constraint thread_members_pk
+		primary key (public_key, thread_hash)
+);
+
+alter table thread_members owner to chainify;
+
+alter table cdms add column if not exists version bigint default 0;
+
+alter table cdms alter column version set default txid_current();
+
+create index if not exists cdms_thread_hash_version_index
+	on cdms (thread_hash, version);
+
+-- The API pages and syncs tables, columns and values rows by (version,
+-- position), position being the order they were ingested in.
+do $$
+declare
+	tbl text;
+begin
+	foreach tbl in array array['tables', 'columns', 'values'] loop
+		if to_regclass(format('%I', tbl)) is not null then
+			execute format('alter table %I add column if not exists position bigserial', tbl);
+			execute format('alter table %I add column if not exists version bigint default 0', tbl);
+			execute format('alter table %I alter column version set default txid_current()', tbl);
+			execute format('drop index if exists %I', tbl || '_recipient_position_index');
+			execute format('create index if not exists %I on %I (recipient, version, position)', tbl || '_recipient_version_index', tbl);
+		end if;
+	end loop;
+end;
+$$;
+
+create or replace function lock_threads(hashes varchar[]) returns void as $$
+begin
+	-- Writers of the same thread take turns: once the lock is granted the
+	-- statements that follow see the other writer's committed rows, and
+	-- threads rows are upserted rather than deleted and re-inserted, so
+	-- they never race on threads_pk. Locks are taken in hash order.
+	perform pg_advisory_xact_lock(hashtext(h))
+	from (select distinct unnest(hashes) as h order by 1) locks;
+end;
+$$ language plpgsql;
+
+create or replace function add_to_threads(hashes varchar[], keys varchar[], timestamps timestamp[], tx_ids varchar[]) returns void as $$
+begin
+	-- Folds new (thread, member, timestamp, tx) entries into threads and
+	-- thread_members without reading the threads' other cdms. The
+	-- threads' version becomes the writing transaction's id.
+	perform lock_threads(hashes);
+
+	insert into threads as t (thread_hash, members, last_timestamp, last_tx_id)
+	select
+		n.thread_hash,
+		array_remove(array_agg(distinct n.public_key), null),
+		max(n.timestamp),
+		(array_agg(n.tx_id order by n.timestamp desc nulls last))[1]
+	from unnest(hashes, keys, timestamps, tx_ids) as n (thread_hash, public_key, timestamp, tx_id)
+	group by n.thread_hash
+	on conflict (thread_hash) do update set
+		members = array(select distinct unnest(t.members || excluded.members)),
+		last_timestamp = greatest(t.last_timestamp, excluded.last_timestamp),
+		last_tx_id = case
+			when excluded.last_timestamp >= t.last_timestamp then excluded.last_tx_id
+			when t.last_timestamp is null and excluded.last_tx_id is not null then excluded.last_tx_id
+			else t.last_tx_id
+		end,
+		version = txid_current();
+
+	insert into thread_members (public_key, thread_hash)
+	select distinct n.public_key, n.thread_hash
+	from unnest(hashes, keys) as n (thread_hash, public_key)
+	where n.public_key is not null
+	on conflict do nothing;
+end;
+$$ language plpgsql;
+
+create or replace function refresh_threads(hashes varchar[]) returns void as $$
+begin
+	-- Rebuilds threads from all their cdms. Only needed when cdms or
+	-- senders are deleted; inserts go through add_to_threads.
+	perform lock_threads(hashes);
+
+	insert into threads (thread_hash, members, last_timestamp, last_tx_id)
+	select
+		c.thread_hash,
+		array(
+			select cc.recipient from cdms cc
+			where cc.thread_hash = c.thread_hash
+			union
+			select t.sender_public_key from cdms cc
+			join transactions t on t.id = cc.tx_id
+			where cc.thread_hash = c.thread_hash
+			union
+			select s.sender from cdms cc
+			join senders s on s.cdm_id = cc.id
+			where cc.thread_hash = c.thread_hash and s.sender is not null
+		),
+		c.timestamp,
+		c.tx_id
+	from (
+		select distinct on (thread_hash) thread_hash, timestamp, tx_id
+		from cdms
+		where thread_hash = any(hashes)
+		order by thread_hash, timestamp desc
+	) c
+	on conflict (thread_hash) do update set
+		members = excluded.members,
+		last_timestamp = excluded.last_timestamp,
+		last_tx_id = excluded.last_tx_id,
+		version = txid_current();
+
+	delete from threads t
+	where t.thread_hash = any(hashes)
+	and not exists (select 1 from cdms c where c.thread_hash = t.thread_hash);
+
+	delete from thread_members m
+	using threads t
+	where t.thread_hash = any(hashes)
+	and m.thread_hash = t.thread_hash
+	and m.public_key <> all(t.members);
+
+	insert into thread_members (public_key, thread_hash)
+	select distinct unnest(members), thread_hash
+	from threads
+	where thread_hash = any(hashes)
+	on conflict do nothing;
+end;
+$$ language plpgsql;
+
+create or replace function cdms_refresh_threads() returns trigger as $$
+begin
+	if tg_op = 'INSERT' then
+		perform add_to_threads(array_agg(k.thread_hash), array_agg(k.public_key), array_agg(k.timestamp), array_agg(k.tx_id))
+		from (
+			select n.thread_hash, n.recipient as public_key, n.timestamp, n.tx_id
+			from changed n
+			union all
+			select n.thread_hash, t.sender_public_key, n.timestamp, n.tx_id
+			from changed n
+			join transactions t on t.id = n.tx_id
+		) k;
+	else
+		perform refresh_threads(array(select distinct thread_hash from changed));
+	end if;
+
+	perform pg_notify('nolikdb_threads', json_build_object(
+		'threadHash', thread_hash,
+		'op', tg_op,
+		'txIds', case when count(distinct tx_id) <= 50 then array_agg(distinct tx_id) end
+	)::text)
+	from changed
+	group by thread_hash;
+
+	return null;
+end;
+$$ language plpgsql;
+
+create or replace function senders_refresh_threads() returns trigger as $$
+begin
+	if tg_op = 'INSERT' then
+		-- A sender only adds a member to the thread of its cdm.
+		perform add_to_threads(array_agg(c.thread_hash), array_agg(s.sender), array_agg(null::timestamp), array_agg(null::varchar))
+		from changed s
+		join cdms c on c.id = s.cdm_id;
+	else
+		perform refresh_threads(array(
+			select distinct c.thread_hash from changed s
+			join cdms c on c.id = s.cdm_id
+		));
+	end if;
+	return null;
+end;
+$$ language plpgsql;
+
+drop trigger if exists cdms_threads_insert on cdms;
+create trigger cdms_threads_insert after insert on cdms
+	referencing new table as changed
+	for each statement execute procedure cdms_refresh_threads();
+
+drop trigger if exists cdms_threads_delete on cdms;
+create trigger cdms_threads_delete after delete on cdms
+	referencing old table as changed
+	for each statement execute procedure cdms_refresh_threads();
+
+drop trigger if exists senders_threads_insert on senders;
+create trigger senders_threads_insert after insert on senders
+	referencing new table as changed
+	for each statement execute procedure senders_refresh_threads();
+
+drop trigger if exists senders_threads_delete on senders;
+create trigger senders_threads_delete after delete on senders
+	referencing old table as changed
+	for each statement execute procedure senders_refresh_threads();
+
+select refresh_threads(array(select distinct thread_hash from cdms));
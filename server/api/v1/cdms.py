@@ -1,166 +1,246 @@
-import os
-import psycopg2
 from sanic import Blueprint
 from sanic.views import HTTPMethodView
-from sanic.response import json
 from .errors import bad_request
+from .db import db
+from .thread_cache import thread_cache
+from .cursors import encode_cursor, decode_cursor, timestamp_key, page, limit_arg
+from .serialize import json
 import configparser
 import base58
 
 config = configparser.ConfigParser()
 config.read('config.ini')
 
-dsn = {
-    "user": os.environ['POSTGRES_USER'],
-    "password": os.environ['POSTGRES_PASSWORD'],
-    "database": os.environ['POSTGRES_DB'],
-    "host": config['DB']['host'],
-    "port": config['DB']['port'],
-    "sslmode": config['DB']['sslmode'],
-    "target_session_attrs": config['DB']['target_session_attrs']
-}
-
 cdms = Blueprint('cdms_v1', url_prefix='/cdms')
 
+
+def ipfs_hash(attachment):
+    return base58.b58decode(attachment).decode('utf-8')
+
+def cdm_data(record):
+    return {
+        'recipient': record[0],
+        'logicalSender': record[1] or record[2],
+        'realSender': record[2],
+        'subject': record[3],
+        'message': record[4],
+        'subjectHash': record[5],
+        'messageHash': record[6],
+        'reSubjectHash': record[7],
+        'reMessageHash': record[8],
+        'fwdSubjectHash': record[9],
+        'fwdMessageHash': record[10],
+        'type': record[11],
+        'threadHash': record[12],
+        'timestamp': record[13],
+        'txId': record[14],
+        'ipfsHash': ipfs_hash(record[15]),
+        'attachmentHash': record[16],
+        'signature': record[17] or record[18][0],
+        'id': record[19]
+    }
+
+def recipient_data(record):
+    return {
+        'publicKey': record[1],
+        'txId': record[2],
+        'timestamp': record[3],
+        'type': record[4]
+    }
+
+
+CDM_COLUMNS = """
+    c.recipient,
+    s.sender,
+    t.sender_public_key,
+    c.subject,
+    c.message,
+    c.subject_hash,
+    c.message_hash,
+    c.re_subject_hash,
+    c.re_message_hash,
+    c.fwd_subject_hash,
+    c.fwd_message_hash,
+    c.type,
+    c.thread_hash,
+    c.timestamp,
+    t.id,
+    t.attachment,
+    t.attachment_hash,
+    s.signature,
+    array(
+        SELECT p.proof
+        FROM proofs p
+        WHERE p.tx_id = t.id
+    ) as proofs,
+    c.id,
+    (
+        SELECT min(cc.timestamp)
+        FROM cdms cc
+        WHERE cc.message_hash = c.fwd_message_hash
+    ) as init_cdm_timestamp
+"""
+
+CDM_FROM = """
+FROM cdms c
+LEFT JOIN transactions t ON c.tx_id = t.id
+LEFT JOIN senders s ON c.id = s.cdm_id
+"""
+
+
 class Cdms(HTTPMethodView):
     @staticmethod
-    def get(request, cdm_id):
-        data = get_cdm(cdm_id)
+    async def get(request, cdm_id):
+        try:
+            data = await get_cdm(cdm_id)
+        except Exception as error:
+            return bad_request(error)
+        return json(data, status=200)
+
+class CdmsBatch(HTTPMethodView):
+    @staticmethod
+    async def get(request):
+        try:
+            cdm_ids = request.args.get('ids').split(',') if request.args.get('ids') else []
+            if len(cdm_ids) > int(config['app']['page_size']):
+                raise ValueError('At most {0} ids per request'.format(config['app']['page_size']))
+            data = await get_cdms_by_id(cdm_ids)
+        except Exception as error:
+            return bad_request(error)
         return json(data, status=200)
 
-def get_cdm(cdm_id):
-    conn = psycopg2.connect(**dsn)
-    try:
-        with conn:
-            with conn.cursor() as cur:
-                sql = """
-                    SELECT c.recipient, c.thread_hash FROM cdms c
-                    WHERE id='{cdm_id}'
-                """.format(
-                    cdm_id=cdm_id
-                )
-                cur.execute(sql)
-                alice, thread_hash = cur.fetchone()
-                cdms = get_cdms(alice, thread_hash)
-
-                cdm_data = None
-                for cdm in cdms:
-                    if cdm['id'] == cdm_id:
-                        cdm_data = cdm
-                        break
-    except Exception as error:
-        return bad_request(error)
-    
-    return cdm_data
-
-def get_cdms(alice, thread_hash):
-    conn = psycopg2.connect(**dsn)
-    try:
-        with conn:
-            with conn.cursor() as cur:
-                sql = """
-                    SELECT DISTINCT ON (c.thread_hash, c.message_hash, c.timestamp, init_cdm_timestamp)
-                        c.recipient,
-                        s.sender,
-                        t.sender_public_key,
-                        c.subject,
-                        c.message,
-                        c.subject_hash,
-                        c.message_hash,
-                        c.re_subject_hash,
-                        c.re_message_hash,
-                        c.fwd_subject_hash,
-                        c.fwd_message_hash,
-                        c.type,
-                        c.thread_hash,
-                        c.timestamp,
-                        t.id,
-                        t.attachment,
-                        t.attachment_hash,
-                        s.signature,
-                        array(
-                            SELECT p.proof
-                            FROM proofs p
-                            WHERE p.tx_id = t.id
-                        ) as proofs,
-                        c.id,
-                        (
-                            SELECT min(cc.timestamp)
-                            FROM cdms cc
-                            WHERE cc.message_hash = c.fwd_message_hash
-                        ) as init_cdm_timestamp
-                    FROM cdms c
-                    LEFT JOIN transactions t ON c.tx_id = t.id
-                    LEFT JOIN senders s ON c.id = s.cdm_id
-                    WHERE (
-                        c.recipient = '{alice}' OR
-                        t.sender_public_key = '{alice}' OR
-                        s.sender = '{alice}'
-                        )
-                    AND c.thread_hash='{thread_hash}'
-                    ORDER BY c.timestamp DESC, init_cdm_timestamp DESC
-                    """.format(
-                        alice=alice,
-                        thread_hash=thread_hash
-                    )
-                
-                cur.execute(sql)
-                records = cur.fetchall()
-
-                cdms = []
-                for record in records:
-                    cur.execute("""
-                        SELECT DISTINCT c.recipient, c.tx_id, c.timestamp, c.type
-                        FROM cdms c
-                        WHERE c.message_hash='{hash}'
-                    """.format(
-                        hash=record[6]
-                    ))
-                    recipients = cur.fetchall()
-                    shared_with = []
-                    for recipient in recipients:
-                        shared_with.append({
-                            'publicKey': recipient[0],
-                            'txId': recipient[1],
-                            'timestamp': recipient[2],
-                            'type': recipient[3]
-                        })
-
-                    data = {
-                        "recipient": record[0],
-                        "logicalSender": record[1] or record[2],
-                        "realSender": record[2],
-                        "subject": record[3],
-                        "message": record[4],
-                        "subjectHash": record[5],
-                        "messageHash": record[6],
-                        "reSubjectHash": record[7],
-                        "reMessageHash": record[8],
-                        "fwdSubjectHash": record[9],
-                        "fwdMessageHash": record[10],
-                        "type": record[11],
-                        "threadHash": record[12],
-                        "timestamp": record[13],
-                        "txId": record[14],
-                        "ipfsHash": base58.b58decode(record[15]).decode('utf-8'),
-                        "attachmentHash": record[16],
-                        "signature": record[17] or record[18][0],
-                        "id": record[19],
-                        "sharedWith": shared_with
-                    }
-
-                    sender, recipient = record[1] or record[2], record[0]
-                    if alice == sender:
-                        data['direction'] = 'self' if sender == recipient else 'outgoing'
-                    else:
-                        data['direction'] = 'incoming'
-                        
-                    cdms.append(data)
-
-
-    except Exception as error:
-        return bad_request(error)
-    
+class ThreadCdms(HTTPMethodView):
+    @staticmethod
+    async def get(request, thread_hash):
+        try:
+            data = await get_thread_page(
+                request.args.get('publicKey'),
+                thread_hash,
+                request.args.get('cursor'),
+                limit_arg(request.args.get('limit')) or int(config['app']['page_size'])
+            )
+        except Exception as error:
+            return bad_request(error)
+        return json(data, status=200)
+
+async def get_cdm(cdm_id):
+    cdms = await get_cdms_by_id([cdm_id])
+    return cdms[0] if cdms else None
+
+async def get_cdms_by_id(cdm_ids):
+    # Looked up by primary key, so the cost does not depend on the length
+    # of the threads the CDMs belong to. Unknown ids are left out.
+    async with db.pool.acquire() as conn:
+        cdms = await load_cdms_by_id(conn, cdm_ids)
+    return [cdms[cdm_id] for cdm_id in cdm_ids if cdm_id in cdms]
+
+async def get_thread_page(alice, thread_hash, cursor, limit):
+    # Newest first; the cursor points at the last CDM returned.
+    before = timestamp_key(decode_cursor(cursor)['before']) if cursor else None
+    async with db.pool.acquire() as conn:
+        cdms = await load_cdms(conn, alice, [thread_hash], before=before, limit=limit + 1)
+
+    cdms, more = page(cdms.get(thread_hash, []), limit)
+    return {
+        'cdms': cdms,
+        'cursor': encode_cursor({'before': [cdms[-1]['timestamp'], cdms[-1]['messageHash']]}) if more else None
+    }
+
+async def cached_cdms(conn, alice, versions):
+    # versions maps thread hashes to their threads.version; only threads
+    # missing from the cache are loaded from Postgres.
+    cdms = await thread_cache.get_many(alice, versions)
+    missing = [thread_hash for thread_hash in versions if thread_hash not in cdms]
+    if missing:
+        loaded = await load_cdms(conn, alice, missing)
+        await thread_cache.set_many(alice, {thread_hash: versions[thread_hash] for thread_hash in missing}, loaded)
+        cdms.update(loaded)
+    return cdms
+
+async def load_cdms(conn, alice, thread_hashes, since=None, before=None, limit=None, tx_ids=None):
+    # CDMs of all the given threads, their proofs and the recipients they
+    # were shared with are loaded with two queries and grouped here by
+    # thread hash, keeping the per-thread order of the query. since keeps
+    # CDMs written after a [version, thread hash] sync key (see
+    # threads.get_threads); before and limit page backwards
+    # through (timestamp, message hash). tx_ids keeps only the CDMs written
+    # by those transactions.
+    args = [alice, thread_hashes]
+    conditions = ''
+    if tx_ids:
+        conditions += 'AND c.tx_id = ANY(${0}::varchar[])\n'.format(len(args) + 1)
+        args.append(tx_ids)
+    if since is not None:
+        conditions += 'AND (c.version, c.thread_hash) > (${0}, ${1})\n'.format(len(args) + 1, len(args) + 2)
+        args += since
+    if before:
+        conditions += 'AND (c.timestamp, c.message_hash) < (${0}, ${1})\n'.format(len(args) + 1, len(args) + 2)
+        args += before
+    limit_sql = ''
+    if limit:
+        limit_sql = 'LIMIT ${0}'.format(len(args) + 1)
+        args.append(limit)
+
+    records = await conn.fetch("""
+        SELECT DISTINCT ON (c.thread_hash, c.message_hash, c.timestamp, init_cdm_timestamp)
+        {0}
+        {1}
+        WHERE (
+            c.recipient = $1 OR
+            t.sender_public_key = $1 OR
+            s.sender = $1
+            )
+        AND c.thread_hash = ANY($2::varchar[])
+        {2}
+        ORDER BY c.timestamp DESC, c.message_hash DESC, c.thread_hash, init_cdm_timestamp DESC
+        {3}
+        """.format(CDM_COLUMNS, CDM_FROM, conditions, limit_sql), *args)
+
+    cdms = {}
+    for data in await cdms_data(conn, records, alice):
+        cdms.setdefault(data['threadHash'], []).append(data)
+    return cdms
+
+async def load_cdms_by_id(conn, cdm_ids):
+    # Keyed by id. Direction is relative to each CDM's own recipient.
+    records = await conn.fetch("""
+        SELECT DISTINCT ON (c.id)
+        {0}
+        {1}
+        WHERE c.id = ANY($1::varchar[])
+        ORDER BY c.id
+        """.format(CDM_COLUMNS, CDM_FROM), cdm_ids)
+
+    return {data['id']: data for data in await cdms_data(conn, records)}
+
+async def cdms_data(conn, records, alice=None):
+    # Maps CDM records and attaches the recipients each message was shared
+    # with, loaded for all the records with one query.
+    recipients = await conn.fetch("""
+        SELECT DISTINCT c.message_hash, c.recipient, c.tx_id, c.timestamp, c.type
+        FROM cdms c
+        WHERE c.message_hash = ANY($1::varchar[])
+    """, list({record[6] for record in records}))
+
+    shared_with = {}
+    for recipient in recipients:
+        shared_with.setdefault(recipient[0], []).append(recipient_data(recipient))
+
+    cdms = []
+    for record in records:
+        data = cdm_data(record)
+        data['sharedWith'] = shared_with.get(record[6], [])
+
+        sender, recipient = record[1] or record[2], record[0]
+        if (alice or recipient) == sender:
+            data['direction'] = 'self' if sender == recipient else 'outgoing'
+        else:
+            data['direction'] = 'incoming'
+
+        cdms.append(data)
+
     return cdms
 
-cdms.add_route(Cdms.as_view(), '/<cdm_id>')
\ No newline at end of file
+cdms.add_route(Cdms.as_view(), '/<cdm_id>')
+cdms.add_route(CdmsBatch.as_view(), '/')
+cdms.add_route(ThreadCdms.as_view(), '/thread/<thread_hash>')
\ No newline at end of file
@@ -1,57 +1,77 @@
-import os
-import psycopg2
 from sanic import Blueprint
 from sanic.views import HTTPMethodView
-from sanic.response import json
 from .errors import bad_request
-import configparser
-import base58
-
-config = configparser.ConfigParser()
-config.read('config.ini')
-
-dsn = {
-    "user": os.environ['POSTGRES_USER'],
-    "password": os.environ['POSTGRES_PASSWORD'],
-    "database": os.environ['POSTGRES_DB'],
-    "host": config['DB']['host'],
-    "port": config['DB']['port'],
-    "sslmode": config['DB']['sslmode'],
-    "target_session_attrs": config['DB']['target_session_attrs']
-}
+from .db import db
+from .cursors import encode_cursor, decode_cursor, page, limit_arg, page_headers, snapshot_xmin, sync_key
+from .serialize import json
+from .streaming import stream_format, stream_records
 
 columns = Blueprint('columns_v1', url_prefix='/columns')
 
 class Columns(HTTPMethodView):
     @staticmethod
-    def get(request, public_key):
-        data = get_columns(public_key)
-        return json(data, status=200)
-
-def get_columns(public_key):
-    conn = psycopg2.connect(**dsn)
-    try:
-        with conn:
-            with conn.cursor() as cur:
-                sql = """
-                    SELECT c.hash, c.ciphertext, t.hash, t.ciphertext
-                    FROM columns c
-                    LEFT JOIN tables t ON t.hash = c.table_hash
-                    WHERE c.recipient='{public_key}'
-                """.format(
-                    public_key=public_key
-                )
-                cur.execute(sql)
-                columns = cur.fetchall()
-
-    except Exception as error:
-        return bad_request(error)
-    
-    return [{
-        'columnHash': col[0],
-        'columnCiphertext': col[1],
-        'tableHash': col[2],
-        'tableCiphertext': col[3]
-    } for col in columns]
+    async def get(request, public_key):
+        try:
+            fmt = stream_format(request.args.get('stream'))
+            if fmt:
+                sql, args = columns_query(public_key, request.args.get('cursor'))
+                return stream_records(sql, args, column_data, fmt)
+
+            data, cursor, more = await get_columns(
+                public_key,
+                request.args.get('cursor'),
+                limit_arg(request.args.get('limit'))
+            )
+        except Exception as error:
+            return bad_request(error)
+        return json(data, status=200, headers=page_headers(cursor, more))
+
+def columns_query(public_key, cursor=None, limit=None):
+    # Keyset pages by (writing transaction, ingestion position); the
+    # cursor of the last page returns only rows written after it.
+    after = decode_cursor(cursor)['after'] if cursor else None
+    args = [public_key]
+    conditions = ''
+    if after is not None:
+        conditions = 'AND (c.version, c.position) > ($2, $3)'
+        args += after
+    limit_sql = ''
+    if limit:
+        args.append(limit + 1)
+        limit_sql = 'LIMIT ${0}'.format(len(args))
+
+    sql = """
+        SELECT c.hash, c.ciphertext, t.hash, t.ciphertext, c.version, c.position
+        FROM columns c
+        LEFT JOIN tables t ON t.hash = c.table_hash AND t.recipient = c.recipient
+        WHERE c.recipient=$1
+        {0}
+        ORDER BY c.version, c.position
+        {1}
+    """.format(conditions, limit_sql)
+    return sql, args
+
+def column_data(record):
+    return {
+        'columnHash': record[0],
+        'columnCiphertext': record[1],
+        'tableHash': record[2],
+        'tableCiphertext': record[3]
+    }
+
+async def get_columns(public_key, cursor=None, limit=None):
+    sql, args = columns_query(public_key, cursor, limit)
+    async with db.pool.acquire() as conn:
+        xmin = await snapshot_xmin(conn)
+        columns = await conn.fetch(sql, *args)
+
+    columns, more = page(columns, limit)
+    last = [columns[-1]['version'], columns[-1]['position']] if columns else None
+    if last is None and cursor:
+        last = decode_cursor(cursor)['after']
+    last, more = sync_key(last, more, xmin, 0)
+    next_cursor = encode_cursor({'after': last}) if last is not None else None
+
+    return [column_data(col) for col in columns], next_cursor, more
 
 columns.add_route(Columns.as_view(), '/<public_key>')
\ No newline at end of file
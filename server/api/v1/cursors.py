@@ -0,0 +1,62 @@
+import json
+import base64
+from datetime import datetime
+
+
+def encode_cursor(position):
+    raw = json.dumps(position, separators=(',', ':'), default=lambda value: value.isoformat())
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+
+def timestamp_key(key):
+    # (timestamp, tie breaker) keys travel as [iso timestamp, value].
+    return [datetime.fromisoformat(key[0]), key[1]] if key else None
+
+
+def page(records, limit):
+    # Queries fetch limit + 1 rows; the extra row only tells that there
+    # is a next page.
+    if limit and len(records) > limit:
+        return records[:limit], True
+    return records, False
+
+
+def limit_arg(value):
+    if not value:
+        return None
+    limit = int(value)
+    if limit < 1:
+        raise ValueError('limit must be a positive integer')
+    return limit
+
+
+async def snapshot_xmin(conn):
+    # Every transaction with an id below this one has committed or rolled
+    # back. Read before the page query, it is at most that query's xmin.
+    return await conn.fetchval('SELECT txid_snapshot_xmin(txid_current_snapshot())')
+
+
+def sync_key(key, more, xmin, floor):
+    # Sync keys are [id of the writing transaction, tie breaker]. Ids are
+    # taken when a transaction starts writing, not when it commits, so a
+    # cursor never moves past xmin: rows of transactions still running
+    # may commit with a lower key, and everything from xmin on is read
+    # again next time. Every finished row before xmin was on this page,
+    # so paging stops there. floor sorts below every tie breaker.
+    if key is None or key[0] < xmin:
+        return key, more
+    return [xmin, floor], False
+
+
+def page_headers(cursor, more):
+    headers = {'X-More': 'true' if more else 'false'}
+    if cursor:
+        headers['X-Cursor'] = cursor
+    return headers
@@ -0,0 +1,43 @@
+import os
+import asyncpg
+import configparser
+
+config = configparser.ConfigParser()
+config.read('config.ini')
+
+dsn = {
+    "user": os.environ['POSTGRES_USER'],
+    "password": os.environ['POSTGRES_PASSWORD'],
+    "database": os.environ['POSTGRES_DB'],
+    "host": config['DB']['host'],
+    "port": config['DB']['port'],
+    "sslmode": config['DB']['sslmode'],
+    "target_session_attrs": config['DB']['target_session_attrs']
+}
+
+
+class Database:
+    # Every worker process opens its own pool when the server starts, so
+    # the API holds at most workers * pool_max_size connections.
+    def __init__(self):
+        self.pool = None
+
+    async def connect(self):
+        self.pool = await asyncpg.create_pool(
+            user=dsn['user'],
+            password=dsn['password'],
+            database=dsn['database'],
+            host=dsn['host'],
+            port=int(dsn['port']),
+            ssl=dsn['sslmode'],
+            min_size=int(config['DB']['pool_min_size']),
+            max_size=int(config['DB']['pool_max_size'])
+        )
+
+    async def close(self):
+        if self.pool:
+            await self.pool.close()
+            self.pool = None
+
+
+db = Database()
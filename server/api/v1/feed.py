@@ -0,0 +1,306 @@
+import os
+import uuid
+import asyncio
+import configparser
+import json as pjson
+from time import time
+import asyncpg
+import redis.asyncio as aioredis
+from sanic import Blueprint
+from sanic.log import logger
+from .db import db, dsn
+from .cdms import load_cdms
+from .serialize import dumps
+
+config = configparser.ConfigParser()
+config.read('config.ini')
+
+feed = Blueprint('feed_v1', url_prefix='/feed')
+
+BATCHES_CHANNEL = 'nolikdb_batches'
+THREADS_CHANNEL = 'nolikdb_threads'
+PRESENCE_CHANNEL = 'nolikdb_presence'
+CONNECTIONS_KEY = 'feed:connections:{0}'
+ONLINE_KEY = 'feed:online'
+
+# Removes a public key from ONLINE_KEY only if its entry has expired, so
+# a worker refreshing it at the same time is never overruled.
+EXPIRE_ONLINE = """
+local score = redis.call('zscore', KEYS[1], ARGV[1])
+if score and tonumber(score) < tonumber(ARGV[2]) then
+    return redis.call('zrem', KEYS[1], ARGV[1])
+end
+return 0
+"""
+
+
+class Subscriber:
+    __slots__ = ('public_key', 'members', 'queue')
+
+    def __init__(self, public_key, members):
+        self.public_key = public_key
+        self.members = members
+        self.queue = asyncio.Queue()
+
+
+class Hub:
+    # One per worker. Every worker LISTENs on its own connection, so an
+    # event reaches the subscribers of every worker; the connection is
+    # re-opened if it drops. Presence lives in Redis as expiring entries
+    # that each worker refreshes for the public keys it has connections
+    # for: CONNECTIONS_KEY holds the workers of one key and ONLINE_KEY
+    # every online key, both scored by expiry time. Entries of a worker
+    # that died or of a Redis that restarted expire or are re-added on
+    # the next refresh, and presence is announced through Postgres when a
+    # key gains its first entry or loses its last one.
+    def __init__(self):
+        self.conn = None
+        self.redis = aioredis.Redis.from_url(os.environ['REDIS_URL'])
+        self.expire_online = self.redis.register_script(EXPIRE_ONLINE)
+        self.worker = uuid.uuid4().hex
+        self.ttl = float(config['feed']['presence_ttl'])
+        self.interval = float(config['feed']['presence_interval'])
+        self.subscribers = {}
+        self.watchers = {}
+        self.keeping = None
+        self.reconnecting = None
+        self.stopping = False
+
+    async def start(self):
+        await self.listen()
+        self.keeping = asyncio.ensure_future(self.keep_alive())
+
+    async def stop(self):
+        # Connections of a worker that shuts down no longer count.
+        self.stopping = True
+        for task in [self.keeping, self.reconnecting]:
+            if task:
+                task.cancel()
+        for public_key in list(self.subscribers):
+            await self.leave(public_key)
+        self.subscribers, self.watchers = {}, {}
+        if self.conn:
+            await self.conn.close()
+            self.conn = None
+
+    async def listen(self):
+        conn = await asyncpg.connect(
+            user=dsn['user'],
+            password=dsn['password'],
+            database=dsn['database'],
+            host=dsn['host'],
+            port=int(dsn['port']),
+            ssl=dsn['sslmode']
+        )
+        for channel in [BATCHES_CHANNEL, THREADS_CHANNEL, PRESENCE_CHANNEL]:
+            await conn.add_listener(channel, self.notified)
+        conn.add_termination_listener(self.terminated)
+        self.conn = conn
+
+    def terminated(self, conn):
+        if conn is self.conn and not self.stopping:
+            logger.warning('Feed LISTEN connection lost')
+            self.reconnect()
+
+    def reconnect(self):
+        self.conn = None
+        if not self.reconnecting or self.reconnecting.done():
+            self.reconnecting = asyncio.ensure_future(self.relisten())
+
+    async def relisten(self):
+        delay = 1
+        while True:
+            try:
+                await self.listen()
+                break
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                logger.error('Feed LISTEN reconnect error: {0}'.format(error))
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.interval)
+
+        # Events sent while the connection was down are lost, so clients
+        # are told to reload.
+        logger.info('Feed LISTEN connection restored')
+        for subscribers in self.subscribers.values():
+            for subscriber in subscribers:
+                subscriber.queue.put_nowait({'type': 'reconnected'})
+
+    async def keep_alive(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if self.conn is None or self.conn.is_closed():
+                self.reconnect()
+            try:
+                await self.refresh_presence()
+                await self.expire_presence()
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                logger.warning('Feed presence refresh error: {0}'.format(error))
+
+    def notified(self, conn, pid, channel, payload):
+        asyncio.get_event_loop().create_task(self.dispatch(channel, pjson.loads(payload)))
+
+    async def dispatch(self, channel, event):
+        try:
+            if channel == BATCHES_CHANNEL:
+                self.on_batch(event)
+            elif channel == THREADS_CHANNEL:
+                await self.on_thread(event)
+            elif channel == PRESENCE_CHANNEL:
+                self.on_presence(event)
+        except Exception as error:
+            logger.error('Feed {0} event error: {1}'.format(channel, error))
+
+    def on_batch(self, event):
+        for public_key in event['publicKeys']:
+            for subscriber in self.subscribers.get(public_key, ()):
+                subscriber.queue.put_nowait({'type': 'rows', 'heights': event['heights']})
+
+    async def on_thread(self, event):
+        thread_hash = event['threadHash']
+        async with db.pool.acquire() as conn:
+            members = await conn.fetchval("SELECT members FROM threads WHERE thread_hash=$1", thread_hash)
+            for member in members or []:
+                subscribers = self.subscribers.get(member)
+                if not subscribers:
+                    continue
+
+                # Without the changed tx ids (deletes, large inserts) the
+                # client is told to reload the thread instead.
+                message = {'type': 'thread', 'threadHash': thread_hash}
+                if event['op'] == 'INSERT' and event['txIds']:
+                    cdms = await load_cdms(conn, member, [thread_hash], tx_ids=event['txIds'])
+                    message = {
+                        'type': 'cdms',
+                        'threadHash': thread_hash,
+                        'cdms': cdms.get(thread_hash, [])
+                    }
+
+                for subscriber in subscribers:
+                    subscriber.queue.put_nowait(message)
+
+    def on_presence(self, event):
+        for subscriber in self.watchers.get(event['publicKey'], ()):
+            subscriber.queue.put_nowait({'type': 'presence', 'publicKey': event['publicKey'], 'online': event['online']})
+
+    async def announce(self, public_key, online):
+        await db.pool.execute(
+            'SELECT pg_notify($1, $2)',
+            PRESENCE_CHANNEL,
+            pjson.dumps({'publicKey': public_key, 'online': online})
+        )
+
+    async def join(self, public_key):
+        now = time()
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zadd(CONNECTIONS_KEY.format(public_key), {self.worker: now + self.ttl})
+            pipe.expire(CONNECTIONS_KEY.format(public_key), int(self.ttl))
+            pipe.zscore(ONLINE_KEY, public_key)
+            pipe.zadd(ONLINE_KEY, {public_key: now + self.ttl})
+            _, _, score, _ = await pipe.execute()
+
+        if score is None or score < now:
+            await self.announce(public_key, True)
+
+    async def leave(self, public_key):
+        now = time()
+        key = CONNECTIONS_KEY.format(public_key)
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.zrem(key, self.worker)
+                pipe.zcount(key, now, '+inf')
+                _, live = await pipe.execute()
+            if not live and await self.redis.zrem(ONLINE_KEY, public_key):
+                await self.announce(public_key, False)
+        except aioredis.RedisError as error:
+            logger.warning('Feed presence error: {0}'.format(error))
+
+    async def refresh_presence(self):
+        public_keys = list(self.subscribers)
+        if not public_keys:
+            return
+
+        expiry = time() + self.ttl
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for public_key in public_keys:
+                pipe.zadd(CONNECTIONS_KEY.format(public_key), {self.worker: expiry})
+                pipe.expire(CONNECTIONS_KEY.format(public_key), int(self.ttl))
+                pipe.zadd(ONLINE_KEY, {public_key: expiry})
+            results = await pipe.execute()
+
+        # Keys that were missing from ONLINE_KEY (Redis restarted, or
+        # another worker just announced them offline) are announced again.
+        for public_key, added in zip(public_keys, results[2::3]):
+            if added:
+                await self.announce(public_key, True)
+
+    async def expire_presence(self):
+        now = time()
+        for public_key in await self.redis.zrangebyscore(ONLINE_KEY, '-inf', now):
+            public_key = public_key.decode('utf-8')
+            if await self.expire_online(keys=[ONLINE_KEY], args=[public_key, now]):
+                await self.announce(public_key, False)
+
+    async def subscribe(self, public_key, members):
+        subscriber = Subscriber(public_key, members)
+        first = public_key not in self.subscribers
+        self.subscribers.setdefault(public_key, set()).add(subscriber)
+        for member in members:
+            self.watchers.setdefault(member, set()).add(subscriber)
+        if first:
+            try:
+                await self.join(public_key)
+            except aioredis.RedisError as error:
+                logger.warning('Feed presence error: {0}'.format(error))
+        return subscriber
+
+    async def unsubscribe(self, subscriber):
+        subscribers = self.subscribers.get(subscriber.public_key)
+        if not subscribers or subscriber not in subscribers:
+            return
+
+        subscribers.discard(subscriber)
+        for member in subscriber.members:
+            self.watchers[member].discard(subscriber)
+            if not self.watchers[member]:
+                del self.watchers[member]
+        if not subscribers:
+            del self.subscribers[subscriber.public_key]
+            await self.leave(subscriber.public_key)
+
+
+hub = Hub()
+
+
+@feed.websocket('/')
+async def feed_socket(request, ws):
+    # Pushes new CDMs of the user's threads, rows ingested for the user and
+    # presence changes of the given thread members:
+    #   /api/v1/feed/?publicKey=<key>&members=<key>,<key>
+    public_key = request.args.get('publicKey')
+    if not public_key:
+        return
+
+    members = request.args.get('members').split(',') if request.args.get('members') else []
+    subscriber = await hub.subscribe(public_key, members)
+    receiving = asyncio.ensure_future(ws.recv())
+    try:
+        while True:
+            # Reading from the socket is what notices a closed client;
+            # anything the client sends is ignored.
+            getting = asyncio.ensure_future(subscriber.queue.get())
+            done, _ = await asyncio.wait([receiving, getting], return_when=asyncio.FIRST_COMPLETED)
+            if getting in done:
+                await ws.send(dumps(getting.result()).decode('utf-8'))
+            else:
+                getting.cancel()
+
+            if receiving in done:
+                receiving.result()
+                receiving = asyncio.ensure_future(ws.recv())
+    finally:
+        receiving.cancel()
+        await hub.unsubscribe(subscriber)
@@ -1,42 +1,49 @@
 import os
 from sanic import Blueprint
 from sanic.views import HTTPMethodView
-from sanic.response import json
-import psycopg2
 import configparser
 from .threads import get_threads
-from .cdms import get_cdms
+from .db import db
+from .errors import bad_request
+from .cursors import limit_arg
+from .serialize import json
 
-import redis
-# from redis.connection import ConnectionPool
+import redis.asyncio as aioredis
 
 config = configparser.ConfigParser()
 config.read('config.ini')
 
+online = aioredis.Redis.from_url(os.environ['REDIS_URL'])
+
 heartbeat = Blueprint('heartbeat_v1', url_prefix='/heartbeat')
 
 
 class HeartBeat(HTTPMethodView):
     @staticmethod
-    def post(request):
+    async def post(request):
         public_key = request.form['publicKey'][0]
         thread_members = request.form['threadMembers'][0].split(',') if 'threadMembers' in request.form else None
         last_tx_id = request.form['lastTxId'][0] if 'lastTxId' in request.form else None
+        cursor = request.form['cursor'][0] if 'cursor' in request.form else None
 
-        client = redis.Redis.from_url(os.environ['REDIS_URL'])
-        r = redis.Redis(connection_pool=client.connection_pool)
-        pipe = r.pipeline()
-        pipe.set(public_key, 'True').expire(public_key, 4).execute()
+        await online.set(public_key, 'True', ex=4)
 
         online_members = []
         if thread_members:
-            for member in thread_members:
-                online_member = pipe.get(member).execute()
-                if online_member[0]:
-                    online_members.append(member)
+            statuses = await online.mget(thread_members)
+            online_members = [member for member, status in zip(thread_members, statuses) if status]
     
+        try:
+            limit = limit_arg(request.form['limit'][0]) if 'limit' in request.form else None
+            async with db.pool.acquire() as conn:
+                threads, cursor, more = await get_threads(conn, public_key, last_tx_id, cursor, limit)
+        except Exception as error:
+            return bad_request(error)
+
         data = {
-            'threads': get_threads(public_key, last_tx_id),
+            'threads': threads,
+            'cursor': cursor,
+            'more': more,
             'cdmVersion': str(os.environ['CDM_VERSION']),
             'apiVersion': str(os.environ['API_VERSION']),
             'onlineMembers': online_members
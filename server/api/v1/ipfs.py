@@ -50,8 +50,22 @@ def create_ipfs_file(data):
     return ipfs_data
 
 
+def read_cached_file(ipfs_hash):
+    if not ipfs_hash.isalnum():
+        return None
+
+    path = os.path.join(config['cache']['path'], ipfs_hash[-2:], ipfs_hash)
+    try:
+        with open(path, 'rb') as f:
+            return f.read().decode('utf-8')
+    except FileNotFoundError:
+        return None
+
+
 def read_ipfs_file(ipfs_hash):
-    data = requests.get('{0}/ipfs/{1}'.format(config['ipfs']['host'], ipfs_hash)).text
+    data = read_cached_file(ipfs_hash)
+    if data is None:
+        data = requests.get('{0}/ipfs/{1}'.format(config['ipfs']['host'], ipfs_hash)).text
     return data
 
 
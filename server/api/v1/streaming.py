@@ -0,0 +1,51 @@
+import configparser
+from sanic.response import stream
+from .db import db
+from .serialize import dumps
+
+config = configparser.ConfigParser()
+config.read('config.ini')
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'json': 'application/json'
+}
+
+
+def stream_format(value):
+    if value and value not in CONTENT_TYPES:
+        raise ValueError('Unknown stream format {0}, expected one of {1}'.format(value, ', '.join(CONTENT_TYPES)))
+    return value
+
+
+def stream_records(sql, args, to_json, fmt, headers=None):
+    # Rows are read from a server-side cursor a chunk at a time and written
+    # as they come, so memory and time to first byte do not depend on how
+    # many rows the query returns. fmt is 'ndjson' (one object per line)
+    # or 'json' (a single array sent in chunks).
+    chunk_size = int(config['app']['stream_chunk_size'])
+
+    async def write(response):
+        async with db.pool.acquire() as conn:
+            async with conn.transaction():
+                cursor = await conn.cursor(sql, *args)
+                if fmt == 'json':
+                    await response.write(b'[')
+
+                first = True
+                while True:
+                    records = await cursor.fetch(chunk_size)
+                    if not records:
+                        break
+
+                    items = [dumps(to_json(record)) for record in records]
+                    if fmt == 'ndjson':
+                        await response.write(b'\n'.join(items) + b'\n')
+                    else:
+                        await response.write((b'' if first else b',') + b','.join(items))
+                    first = False
+
+                if fmt == 'json':
+                    await response.write(b']')
+
+    return stream(write, content_type=CONTENT_TYPES[fmt], headers=headers)
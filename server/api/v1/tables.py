@@ -1,62 +1,74 @@
-import os
-import psycopg2
 from sanic import Blueprint
 from sanic.views import HTTPMethodView
-from sanic.response import json
 from .errors import bad_request
-import configparser
-import base58
-
-config = configparser.ConfigParser()
-config.read('config.ini')
-
-dsn = {
-    "user": os.environ['POSTGRES_USER'],
-    "password": os.environ['POSTGRES_PASSWORD'],
-    "database": os.environ['POSTGRES_DB'],
-    "host": config['DB']['host'],
-    "port": config['DB']['port'],
-    "sslmode": config['DB']['sslmode'],
-    "target_session_attrs": config['DB']['target_session_attrs']
-}
+from .db import db
+from .cursors import encode_cursor, decode_cursor, page, limit_arg, page_headers, snapshot_xmin, sync_key
+from .serialize import json
+from .streaming import stream_format, stream_records
 
 tables = Blueprint('tables_v1', url_prefix='/tables')
 
 class Tables(HTTPMethodView):
     @staticmethod
-    def get(request, public_key):
-        data = get_tables(public_key)
-        return json(data, status=200)
-
-def get_tables(public_key):
-    conn = psycopg2.connect(**dsn)
-    try:
-        with conn:
-            with conn.cursor() as cur:
-                sql = """
-                    SELECT t.hash, t.ciphertext FROM tables t
-                    WHERE recipient='{public_key}'
-                """.format(
-                    public_key=public_key
-                )
-                cur.execute(sql)
-                tables = cur.fetchall()
-
-                sql = """
-                    SELECT t.hash, t.ciphertext FROM tables t
-                    WHERE recipient='{public_key}'
-                """.format(
-                    public_key=public_key
-                )
-                cur.execute(sql)
-                tables = cur.fetchall()
-
-    except Exception as error:
-        return bad_request(error)
-    
-    return [{
-        'hash': table[0],
-        'ciphertext': table[1]
-    } for table in tables]
+    async def get(request, public_key):
+        try:
+            fmt = stream_format(request.args.get('stream'))
+            if fmt:
+                sql, args = tables_query(public_key, request.args.get('cursor'))
+                return stream_records(sql, args, table_data, fmt)
+
+            data, cursor, more = await get_tables(
+                public_key,
+                request.args.get('cursor'),
+                limit_arg(request.args.get('limit'))
+            )
+        except Exception as error:
+            return bad_request(error)
+        return json(data, status=200, headers=page_headers(cursor, more))
+
+def tables_query(public_key, cursor=None, limit=None):
+    # Keyset pages by (writing transaction, ingestion position); the
+    # cursor of the last page returns only rows written after it.
+    after = decode_cursor(cursor)['after'] if cursor else None
+    args = [public_key]
+    conditions = ''
+    if after is not None:
+        conditions = 'AND (t.version, t.position) > ($2, $3)'
+        args += after
+    limit_sql = ''
+    if limit:
+        args.append(limit + 1)
+        limit_sql = 'LIMIT ${0}'.format(len(args))
+
+    sql = """
+        SELECT t.hash, t.ciphertext, t.version, t.position
+        FROM tables t
+        WHERE t.recipient=$1
+        {0}
+        ORDER BY t.version, t.position
+        {1}
+    """.format(conditions, limit_sql)
+    return sql, args
+
+def table_data(record):
+    return {
+        'hash': record[0],
+        'ciphertext': record[1]
+    }
+
+async def get_tables(public_key, cursor=None, limit=None):
+    sql, args = tables_query(public_key, cursor, limit)
+    async with db.pool.acquire() as conn:
+        xmin = await snapshot_xmin(conn)
+        tables = await conn.fetch(sql, *args)
+
+    tables, more = page(tables, limit)
+    last = [tables[-1]['version'], tables[-1]['position']] if tables else None
+    if last is None and cursor:
+        last = decode_cursor(cursor)['after']
+    last, more = sync_key(last, more, xmin, 0)
+    next_cursor = encode_cursor({'after': last}) if last is not None else None
+
+    return [table_data(table) for table in tables], next_cursor, more
 
 tables.add_route(Tables.as_view(), '/<public_key>')
\ No newline at end of file
@@ -0,0 +1,61 @@
+import os
+import redis.asyncio as aioredis
+import configparser
+from sanic.log import logger
+from .serialize import dumps, loads
+
+config = configparser.ConfigParser()
+config.read('config.ini')
+
+
+class ThreadCache:
+    # Serialized CDM lists per (user, thread, thread version). The version
+    # comes from the threads row, which the thread index triggers replace
+    # in the same transaction that writes or removes a CDM, so a committed
+    # change is never served stale and old entries simply expire. Redis
+    # errors are treated as misses. A disabled cache always misses.
+    def __init__(self, url, ttl, max_bytes):
+        self.redis = aioredis.Redis.from_url(url)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.enabled = True
+
+    def key(self, alice, thread_hash, version):
+        return 'cdms:{0}:{1}:{2}'.format(alice, thread_hash, version)
+
+    async def get_many(self, alice, versions):
+        if not versions or not self.enabled:
+            return {}
+
+        try:
+            values = await self.redis.mget([self.key(alice, thread_hash, version) for thread_hash, version in versions.items()])
+        except aioredis.RedisError as error:
+            logger.warning('Thread cache read error: {0}'.format(error))
+            return {}
+
+        return {
+            thread_hash: loads(value)
+            for thread_hash, value in zip(versions, values)
+            if value is not None
+        }
+
+    async def set_many(self, alice, versions, cdms):
+        if not self.enabled:
+            return
+
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for thread_hash, version in versions.items():
+                value = dumps(cdms.get(thread_hash, []))
+                if len(value) <= self.max_bytes:
+                    pipe.set(self.key(alice, thread_hash, version), value, ex=self.ttl)
+            await pipe.execute()
+        except aioredis.RedisError as error:
+            logger.warning('Thread cache write error: {0}'.format(error))
+
+
+thread_cache = ThreadCache(
+    os.environ['REDIS_URL'],
+    int(config['redis']['thread_ttl']),
+    int(config['redis']['thread_max_bytes'])
+)
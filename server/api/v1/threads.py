@@ -1,87 +1,64 @@
 import os
 import time
-import psycopg2
-from .cdms import get_cdms
-from .errors import bad_request
-import configparser
+from .cdms import cached_cdms, load_cdms
+from .cursors import encode_cursor, decode_cursor, page, snapshot_xmin, sync_key
 
 
-config = configparser.ConfigParser()
-config.read('config.ini')
+async def get_threads(conn, alice, last_tx_id = None, cursor = None, limit = None):
+    # With a cursor or a limit, threads are paged in the order they were
+    # last written, keyed by [threads.version, thread hash]. The cursor of
+    # the last page doubles as a sync position: threads written after it
+    # are returned with only the CDMs written after it.
+    after, since = None, None
+    if cursor:
+        position = decode_cursor(cursor)
+        after, since = position['after'], position['since']
 
-dsn = {
-    "user": os.environ['POSTGRES_USER'],
-    "password": os.environ['POSTGRES_PASSWORD'],
-    "database": os.environ['POSTGRES_DB'],
-    "host": config['DB']['host'],
-    "port": config['DB']['port'],
-    "sslmode": config['DB']['sslmode'],
-    "target_session_attrs": config['DB']['target_session_attrs']
-}
+    # threads and thread_members are kept up to date by triggers on
+    # cdms and senders, so listing is an index lookup on the member.
+    sql = """
+        SELECT t.thread_hash, t.members, t.last_timestamp, t.version
+        FROM thread_members m
+        JOIN threads t ON t.thread_hash = m.thread_hash
+        WHERE m.public_key = $1
+    """
+    args = [alice]
 
-def get_threads(alice, last_tx_id = None):
-    conn = psycopg2.connect(**dsn)
-    try:
-        with conn:
-            with conn.cursor() as cur:
-                sql = """
-                    SELECT DISTINCT
-                        c.thread_hash,
-                        array(
-                            SELECT recipient FROM cdms cc
-                            WHERE c.thread_hash = cc.thread_hash
-                            UNION
-                            SELECT tt.sender_public_key FROM transactions tt
-                            WHERE c.tx_id = tt.id
-                            UNION
-                            SELECT ss.sender FROM senders ss
-                            LEFT JOIN cdms cc ON cc.id = ss.cdm_id
-                            WHERE c.thread_hash = cc.thread_hash
-                        ),
-                        c.timestamp
-                    FROM cdms c
-                    LEFT JOIN transactions t on c.tx_id = t.id
-                    LEFT JOIN senders s on c.id = s.cdm_id
-                    WHERE (
-                        c.recipient = '{alice}' OR 
-                        t.sender_public_key = '{alice}' OR
-                        s.sender = '{alice}'
-                        )
-                    AND c.timestamp IN (
-                        SELECT max(timestamp)
-                        FROM cdms
-                        WHERE thread_hash = c.thread_hash
-                    )
-                """.format(
-                    alice=alice
-                )
+    if last_tx_id:
+        args.append(last_tx_id)
+        sql += "AND t.last_timestamp > (SELECT DISTINCT timestamp FROM cdms WHERE tx_id=${0})\n".format(len(args))
+    if after is not None:
+        args += after
+        sql += "AND (t.version, t.thread_hash) > (${0}, ${1})\n".format(len(args) - 1, len(args))
+    if cursor or limit:
+        sql += "ORDER BY t.version ASC, t.thread_hash ASC"
+    else:
+        sql += "ORDER BY t.last_timestamp ASC, t.thread_hash ASC"
+    if limit:
+        args.append(limit + 1)
+        sql += "\nLIMIT ${0}".format(len(args))
 
-                if last_tx_id:
-                    sql += "AND c.timestamp > (SELECT DISTINCT timestamp FROM cdms WHERE tx_id='{0}')".format(last_tx_id)
-                sql += "\nORDER BY c.timestamp ASC"
+    xmin = await snapshot_xmin(conn)
+    records, more = page(await conn.fetch(sql, *args), limit)
 
-                cur.execute(sql)
-                records = cur.fetchall()
+    if since is not None:
+        cdms = await load_cdms(conn, alice, [record[0] for record in records], since=since)
+    else:
+        cdms = await cached_cdms(conn, alice, {record[0]: record[3] for record in records})
 
-                sponsor = os.environ['SPONSOR_PUBLIC_KEY']
-                threads = []
-                thread_hashes = []
-                for record in records:
-                    thread_hash = record[0]
-                    if (thread_hash in thread_hashes):
-                        continue
-                    members = record[1]
-                    cdms = get_cdms(alice, thread_hash)
-                    thread = {
-                        'members': [member for member in members if member not in [alice, sponsor]],
-                        'threadHash': thread_hash,
-                        'cdms': cdms
-                    }
-                    threads.append(thread)
+    sponsor = os.environ['SPONSOR_PUBLIC_KEY']
+    threads = []
+    for record in records:
+        thread = {
+            'members': [member for member in record[1] if member not in [alice, sponsor]],
+            'threadHash': record[0],
+            'cdms': cdms.get(record[0], [])
+        }
+        threads.append(thread)
 
-                
+    last, more = sync_key(max([[record[3], record[0]] for record in records], default=after), more, xmin, '')
+    next_cursor = None
+    if last is not None:
+        next_cursor = encode_cursor({'after': last, 'since': since if more else last})
 
-    except Exception as error:
-        return bad_request(error)
-    
-    return threads
+    return threads, next_cursor, more
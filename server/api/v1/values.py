@@ -1,55 +1,76 @@
-import os
-import psycopg2
 from sanic import Blueprint
 from sanic.views import HTTPMethodView
-from sanic.response import json
 from .errors import bad_request
-import configparser
-import base58
-
-config = configparser.ConfigParser()
-config.read('config.ini')
-
-dsn = {
-    "user": os.environ['POSTGRES_USER'],
-    "password": os.environ['POSTGRES_PASSWORD'],
-    "database": os.environ['POSTGRES_DB'],
-    "host": config['DB']['host'],
-    "port": config['DB']['port'],
-    "sslmode": config['DB']['sslmode'],
-    "target_session_attrs": config['DB']['target_session_attrs']
-}
+from .db import db
+from .cursors import encode_cursor, decode_cursor, page, limit_arg, page_headers, snapshot_xmin, sync_key
+from .serialize import json
+from .streaming import stream_format, stream_records
 
 values = Blueprint('values_v1', url_prefix='/values')
 
 class Values(HTTPMethodView):
     @staticmethod
-    def get(request, public_key):
-        data = get_values(public_key)
-        return json(data, status=200)
-
-def get_values(public_key):
-    conn = psycopg2.connect(**dsn)
-    try:
-        with conn:
-            with conn.cursor() as cur:
-                sql = """
-                    SELECT v.col_hash, v.col_ciphertext, v.val_hash, v.val_ciphertext FROM values v
-                    WHERE v.recipient='{public_key}'
-                """.format(
-                    public_key=public_key
-                )
-                cur.execute(sql)
-                values = cur.fetchall()
-
-    except Exception as error:
-        return bad_request(error)
-    
-    return [{
-        'columnHash': val[0],
-        'columnCiphertext': val[1],
-        'valueHash': val[2],
-        'valueCiphertext': val[3]
-    } for val in values]
+    async def get(request, public_key):
+        try:
+            fmt = stream_format(request.args.get('stream'))
+            if fmt:
+                sql, args = values_query(public_key, request.args.get('cursor'))
+                return stream_records(sql, args, value_data, fmt)
+
+            data, cursor, more = await get_values(
+                public_key,
+                request.args.get('cursor'),
+                limit_arg(request.args.get('limit'))
+            )
+        except Exception as error:
+            return bad_request(error)
+        return json(data, status=200, headers=page_headers(cursor, more))
+
+def values_query(public_key, cursor=None, limit=None):
+    # Keyset pages by (writing transaction, ingestion position); the
+    # cursor of the last page returns only rows written after it.
+    after = decode_cursor(cursor)['after'] if cursor else None
+    args = [public_key]
+    conditions = ''
+    if after is not None:
+        conditions = 'AND (v.version, v.position) > ($2, $3)'
+        args += after
+    limit_sql = ''
+    if limit:
+        args.append(limit + 1)
+        limit_sql = 'LIMIT ${0}'.format(len(args))
+
+    sql = """
+        SELECT v.col_hash, v.col_ciphertext, v.val_hash, v.val_ciphertext, v.version, v.position
+        FROM "values" v
+        WHERE v.recipient=$1
+        {0}
+        ORDER BY v.version, v.position
+        {1}
+    """.format(conditions, limit_sql)
+    return sql, args
+
+def value_data(record):
+    return {
+        'columnHash': record[0],
+        'columnCiphertext': record[1],
+        'valueHash': record[2],
+        'valueCiphertext': record[3]
+    }
+
+async def get_values(public_key, cursor=None, limit=None):
+    sql, args = values_query(public_key, cursor, limit)
+    async with db.pool.acquire() as conn:
+        xmin = await snapshot_xmin(conn)
+        values = await conn.fetch(sql, *args)
+
+    values, more = page(values, limit)
+    last = [values[-1]['version'], values[-1]['position']] if values else None
+    if last is None and cursor:
+        last = decode_cursor(cursor)['after']
+    last, more = sync_key(last, more, xmin, 0)
+    next_cursor = encode_cursor({'after': last}) if last is not None else None
+
+    return [value_data(val) for val in values], next_cursor, more
 
 values.add_route(Values.as_view(), '/<public_key>')
\ No newline at end of file
@@ -0,0 +1,112 @@
+# Compares building and encoding a heartbeat payload the way the API
+# used to (positional dicts and Sanic's json_dumps) with the per-query
+# mapper functions and orjson, on synthetic CDM records shaped like load_cdms rows.
+#
+#   docker exec -it nolikdb-api python3.7 -m benchmarks.serialize --threads 50 --cdms 20
+
+import uuid
+import random
+import argparse
+from time import time
+from datetime import datetime, timedelta
+
+import base58
+from sanic.response import json_dumps
+
+from api.v1.serialize import dumps
+from api.v1.cdms import cdm_data, recipient_data
+
+
+def make_records(threads, cdms_per_thread, recipients):
+    records, shared = [], []
+    now = datetime.now()
+    for _ in range(threads):
+        thread_hash = uuid.uuid4().hex
+        members = [uuid.uuid4().hex for _ in range(recipients)]
+        for _ in range(cdms_per_thread):
+            message_hash = uuid.uuid4().hex
+            timestamp = now - timedelta(seconds=random.randint(0, 10 ** 6))
+            attachment = base58.b58encode(('Qm' + uuid.uuid4().hex).encode('utf-8')).decode('utf-8')
+            records.append((
+                members[0], None, members[1], 'subject', 'message ' * 20, uuid.uuid4().hex, message_hash,
+                None, None, None, None, 'message', thread_hash, timestamp, uuid.uuid4().hex,
+                attachment, uuid.uuid4().hex, None, [uuid.uuid4().hex], uuid.uuid4().hex
+            ))
+            for member in members:
+                shared.append((message_hash, member, uuid.uuid4().hex, timestamp, 'message'))
+    return records, shared
+
+
+def legacy(records, shared):
+    shared_with = {}
+    for recipient in shared:
+        shared_with.setdefault(recipient[0], []).append({
+            'publicKey': recipient[1],
+            'txId': recipient[2],
+            'timestamp': recipient[3],
+            'type': recipient[4]
+        })
+
+    threads = {}
+    for record in records:
+        threads.setdefault(record[12], []).append({
+            "recipient": record[0],
+            "logicalSender": record[1] or record[2],
+            "realSender": record[2],
+            "subject": record[3],
+            "message": record[4],
+            "subjectHash": record[5],
+            "messageHash": record[6],
+            "reSubjectHash": record[7],
+            "reMessageHash": record[8],
+            "fwdSubjectHash": record[9],
+            "fwdMessageHash": record[10],
+            "type": record[11],
+            "threadHash": record[12],
+            "timestamp": record[13],
+            "txId": record[14],
+            "ipfsHash": base58.b58decode(record[15]).decode('utf-8'),
+            "attachmentHash": record[16],
+            "signature": record[17] or record[18][0],
+            "id": record[19],
+            "sharedWith": shared_with.get(record[6], [])
+        })
+    return json_dumps({'threads': [{'threadHash': key, 'cdms': value} for key, value in threads.items()]})
+
+
+def mapped(records, shared):
+    shared_with = {}
+    for recipient in shared:
+        shared_with.setdefault(recipient[0], []).append(recipient_data(recipient))
+
+    threads = {}
+    for record in records:
+        data = cdm_data(record)
+        data['sharedWith'] = shared_with.get(record[6], [])
+        threads.setdefault(record[12], []).append(data)
+    return dumps({'threads': [{'threadHash': key, 'cdms': value} for key, value in threads.items()]})
+
+
+def main():
+    args = argparse.ArgumentParser()
+    args.add_argument('--threads', type=int, default=50)
+    args.add_argument('--cdms', type=int, default=20, help='messages per thread')
+    args.add_argument('--recipients', type=int, default=3)
+    args.add_argument('--repeat', type=int, default=20)
+    args = args.parse_args()
+
+    records, shared = make_records(args.threads, args.cdms, args.recipients)
+    print('{0} cdm records, {1} recipient records'.format(len(records), len(shared)))
+
+    for name, encode in [('legacy', legacy), ('mapped', mapped)]:
+        best = None
+        for _ in range(args.repeat):
+            t0 = time()
+            body = encode(records, shared)
+            elapsed = time() - t0
+            best = elapsed if best is None else min(best, elapsed)
+        print('{0:>10}: {1:.2f} ms, {2} bytes'.format(name, best * 1000, len(body)))
+
+
+if __name__ == '__main__':
+    main()
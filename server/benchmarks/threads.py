@@ -0,0 +1,151 @@
+# Compares the thread scan and per-thread and per-CDM queries the
+# heartbeat used to run with the thread index and set-based loader, on
+# threads seeded for one user inside a transaction that is rolled back,
+# so it is safe to point at a live database. The seeded cdms go through
+# the thread index triggers like any other insert. The Redis thread cache
+# is disabled, so every run times Postgres and nothing is written to Redis.
+#
+#   docker exec -it nolikdb-api python3.7 -m benchmarks.threads --threads 200 --cdms 10
+
+import os
+import uuid
+import random
+import asyncio
+import argparse
+from time import time
+from datetime import datetime, timedelta
+
+import base58
+import asyncpg
+
+from api.v1.db import dsn
+from api.v1.threads import get_threads
+from api.v1.thread_cache import thread_cache
+
+LEGACY_CDMS = """
+    SELECT DISTINCT ON (c.thread_hash, c.message_hash, c.timestamp, init_cdm_timestamp)
+        c.recipient, s.sender, t.sender_public_key, c.message_hash, c.thread_hash, c.timestamp, t.id,
+        s.signature,
+        array(SELECT p.proof FROM proofs p WHERE p.tx_id = t.id) as proofs,
+        c.id,
+        (SELECT min(cc.timestamp) FROM cdms cc WHERE cc.message_hash = c.fwd_message_hash) as init_cdm_timestamp
+    FROM cdms c
+    LEFT JOIN transactions t ON c.tx_id = t.id
+    LEFT JOIN senders s ON c.id = s.cdm_id
+    WHERE (c.recipient = $1 OR t.sender_public_key = $1 OR s.sender = $1)
+    AND c.thread_hash = $2
+    ORDER BY c.timestamp DESC, init_cdm_timestamp DESC
+"""
+
+LEGACY_THREADS = """
+    SELECT DISTINCT c.thread_hash, c.timestamp
+    FROM cdms c
+    LEFT JOIN transactions t on c.tx_id = t.id
+    LEFT JOIN senders s on c.id = s.cdm_id
+    WHERE (c.recipient = $1 OR t.sender_public_key = $1 OR s.sender = $1)
+    AND c.timestamp IN (SELECT max(timestamp) FROM cdms WHERE thread_hash = c.thread_hash)
+    ORDER BY c.timestamp ASC
+"""
+
+
+async def seed(conn, alice, threads, cdms_per_thread, recipients):
+    transactions, proofs, cdms = [], [], []
+    now = datetime.now()
+    for _ in range(threads):
+        thread_hash = uuid.uuid4().hex
+        members = [alice] + [uuid.uuid4().hex for _ in range(recipients - 1)]
+        for i in range(cdms_per_thread):
+            message_hash = uuid.uuid4().hex
+            sender = random.choice(members)
+            timestamp = now - timedelta(seconds=random.randint(0, 10 ** 6))
+            for recipient in members:
+                tx_id = 'bench-{0}'.format(uuid.uuid4())
+                attachment = base58.b58encode(('Qm' + uuid.uuid4().hex).encode('utf-8')).decode('utf-8')
+                transactions.append((tx_id, 1, 4, sender, sender, recipient, 2, attachment, uuid.uuid4().hex))
+                proofs.append((tx_id, uuid.uuid4().hex, 'proof-{0}'.format(uuid.uuid4())))
+                cdms.append((
+                    'bench-{0}'.format(uuid.uuid4()), tx_id, recipient, 'message', message_hash,
+                    thread_hash, timestamp, 'subject'
+                ))
+
+    await conn.copy_records_to_table('transactions', records=transactions, columns=[
+        'id', 'height', 'type', 'sender', 'sender_public_key', 'recipient', 'version', 'attachment', 'attachment_hash'])
+    await conn.copy_records_to_table('proofs', records=proofs, columns=['tx_id', 'proof', 'id'])
+    await conn.copy_records_to_table('cdms', records=cdms, columns=[
+        'id', 'tx_id', 'recipient', 'message', 'message_hash', 'thread_hash', 'timestamp', 'subject'])
+    await conn.execute('ANALYZE cdms')
+    return len(cdms)
+
+
+async def legacy_threads(conn, alice):
+    queries = 1
+    threads = []
+    for thread in await conn.fetch(LEGACY_THREADS, alice):
+        records = await conn.fetch(LEGACY_CDMS, alice, thread['thread_hash'])
+        queries += 1
+        for record in records:
+            await conn.fetch("""
+                SELECT DISTINCT c.recipient, c.tx_id, c.timestamp, c.type
+                FROM cdms c
+                WHERE c.message_hash=$1
+            """, record['message_hash'])
+            queries += 1
+        threads.append(thread['thread_hash'])
+    return threads, queries
+
+
+async def run(args):
+    conn = await asyncpg.connect(
+        user=dsn['user'],
+        password=dsn['password'],
+        database=dsn['database'],
+        host=dsn['host'],
+        port=int(dsn['port']),
+        ssl=dsn['sslmode']
+    )
+    try:
+        tr = conn.transaction()
+        await tr.start()
+        alice = uuid.uuid4().hex
+        rows = await seed(conn, alice, args.threads, args.cdms, args.recipients)
+        print('Seeded {0} threads, {1} cdm rows'.format(args.threads, rows))
+
+        for name, load in [
+            ('per thread', lambda: legacy_threads(conn, alice)),
+            ('set based', lambda: get_threads(conn, alice))
+        ]:
+            best = None
+            for _ in range(args.repeat):
+                t0 = time()
+                result = await load()
+                elapsed = time() - t0
+                best = elapsed if best is None else min(best, elapsed)
+
+            if name == 'per thread':
+                legacy_hashes, queries = result
+                print('{0:>12}: {1:.3f} sec, {2} queries'.format(name, best, queries))
+            else:
+                threads, _, _ = result
+                assert sorted(thread['threadHash'] for thread in threads) == sorted(legacy_hashes)
+                print('{0:>12}: {1:.3f} sec, 3 queries'.format(name, best))
+
+        await tr.rollback()
+    finally:
+        await conn.close()
+
+
+def main():
+    args = argparse.ArgumentParser()
+    args.add_argument('--threads', type=int, default=200)
+    args.add_argument('--cdms', type=int, default=10, help='messages per thread')
+    args.add_argument('--recipients', type=int, default=3, help='members per thread, including the user')
+    args.add_argument('--repeat', type=int, default=3)
+    args = args.parse_args()
+
+    os.environ.setdefault('SPONSOR_PUBLIC_KEY', '')
+    thread_cache.enabled = False
+    asyncio.get_event_loop().run_until_complete(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,8 @@
 import os
 from sanic import Sanic
 from api import api_v1
+from api.v1.db import db
+from api.v1.feed import hub
 import configparser
 from sanic_cors import CORS
 
@@ -9,7 +11,20 @@ config.read('config.ini')
 
 app = Sanic('nolik_api')
 app.blueprint(api_v1)
-cors = CORS(app, resources={r"/api/*": {"origins": os.environ['ORIGINS'].split(',')}})
+cors = CORS(app, resources={r"/api/*": {"origins": os.environ['ORIGINS'].split(',')}}, expose_headers=['X-Cursor', 'X-More'])
+
+
+@app.listener('before_server_start')
+async def open_db(app, loop):
+    await db.connect()
+    await hub.start()
+
+
+@app.listener('after_server_stop')
+async def close_db(app, loop):
+    await hub.stop()
+    await db.close()
+
 
 if __name__ == "__main__":
     env = os.environ['ENV']